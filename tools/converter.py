@@ -2,21 +2,312 @@ import os
 import asyncio
 import aiohttp
 import json
+import orjson
+from charset_normalizer import from_bytes
 import time
+import random
+from email.utils import parsedate_to_datetime
 import argparse
-from typing import List, Dict, Any
+import codecs
+import threading
+import concurrent.futures
+import contextlib
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Callable
 import logging
+import logging.handlers
+import queue
+import atexit
 import re
 import sys
 import glob
+import fnmatch
+import hashlib
+import bisect
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from text_utils import BRACKET_RE, BLANKLINES_RE, iter_sentences, is_trivial, split_incomplete, normalize_layout
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 # 设置标准输出编码为UTF-8以支持中文字符
 if sys.platform == 'win32':
-    import codecs
     sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer)
     sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer)
 
+# 流式接收时，不完整句子标记开启后超过该长度仍未闭合，视为模型失控，提前中断本次请求
+_MAX_INCOMPLETE_CHARS = 600
+
+# 请求彻底失败的块原样保留在输出中，并以此标题标出
+_FAILED_CHUNK_HEADER = "# 处理失败的内容"
+
+# 最终清理使用的模式
+# 只移除特定的格式标记和不完整句子标记，但保留其他可能有用的标记；合并为一个分支模式，一次扫描完成
+_FORMAT_MARKERS_RE = re.compile(
+    r'\[英文整理段落\]'
+    r'|\[对应中文翻译\]'
+    r'|\[如有不完整句子\]'
+    r'|\[不完整句子(?::[^\]]*)?\]'
+    r'|\[文件末尾不完整句子:[^\]]*\]'
+)
+_LONG_BRACKET_RE = re.compile(r'\[[^\]]{100,}\]')  # 超过100字符的方括号内容
+
+# 生产者线程等待入队时检查停止标记的间隔（秒）
+_PRODUCER_POLL_SECONDS = 0.1
+
+# 边界优化按段落（连续空行）定位上下文
+_PARAGRAPH_SEP_RE = re.compile(r'\n\n+')
+
+
+def _iter_files(folder: Path, pattern: str) -> Iterator[Path]:
+    """逐个产出文件夹中匹配模式的文件，找到第一个即可开始处理"""
+    with os.scandir(folder) as it:
+        for entry in it:
+            if fnmatch.fnmatch(entry.name, pattern) and entry.is_file():
+                yield Path(entry.path)
+
+
+# 进程内共享的API会话：TCP连接与TLS握手在所有块、所有文件以及边界优化之间复用
+_DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=600)
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def get_session(limit_per_host: int = 16) -> aiohttp.ClientSession:
+    """
+    获取共享的API会话，首次调用、会话已关闭或换了事件循环时新建
+    
+    Args:
+        limit_per_host: 新建会话时单个主机的连接数上限
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=max(100, 2 * limit_per_host),
+            limit_per_host=limit_per_host,
+            ttl_dns_cache=300,
+            keepalive_timeout=75,
+            enable_cleanup_closed=True
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=_DEFAULT_TIMEOUT)
+        _session_loop = loop
+    return _session
+
+
+async def close_session() -> None:
+    """关闭共享的API会话，下次 get_session() 时重新建立"""
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _session_loop = None
+
+
+class APIError(Exception):
+    """API返回了非200状态码"""
+    
+    def __init__(self, status: int, message: str):
+        super().__init__(f"API错误 {status}: {message}")
+        self.status = status
+
+
+@dataclass(slots=True)
+class FileResult:
+    """批量处理中单个文件的结果记录"""
+    input: str
+    output: Optional[str]
+    status: str
+    error: Optional[str] = None
+
+
+class _InflightCancelled(Exception):
+    """发起在途请求的任务被取消，等待该请求结果的其他任务需要自行重试"""
+
+
+def _parse_retry_after(value: str) -> Optional[float]:
+    """解析 Retry-After 头，支持秒数和HTTP日期两种格式，返回需要等待的秒数"""
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """按最小请求间隔放行的令牌桶限流器，在发送前主动等待而不是等429后再退避"""
+    
+    def __init__(self, requests_per_second: float):
+        self.base_interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self.interval = self.base_interval
+        self.next_allowed = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        """等待直到允许发出下一个请求"""
+        if self.interval <= 0 and self.next_allowed <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            wait = self.next_allowed - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.next_allowed = max(loop.time(), self.next_allowed) + self.interval
+    
+    def update_from_headers(self, headers) -> None:
+        """根据服务端返回的限流头调整放行节奏"""
+        now = asyncio.get_running_loop().time()
+        
+        # Retry-After: 在指定时间内暂停所有请求
+        retry_after = headers.get('Retry-After')
+        if retry_after:
+            delay = _parse_retry_after(retry_after)
+            if delay is not None:
+                self.next_allowed = max(self.next_allowed, now + delay)
+        
+        # X-RateLimit-Remaining / X-RateLimit-Reset: 把剩余额度均匀分摊到重置窗口内
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if remaining is not None and reset is not None:
+            try:
+                remaining, reset = int(remaining), float(reset)
+            except ValueError:
+                return
+            if reset > 1e9:
+                # 部分服务返回的是重置时刻的Unix时间戳而不是剩余秒数
+                reset = max(0.0, reset - time.time())
+            if remaining <= 0:
+                self.next_allowed = max(self.next_allowed, now + reset)
+            else:
+                self.interval = max(self.base_interval, reset / remaining)
+    
+    def pause_remaining(self) -> float:
+        """服务端要求的全局暂停还剩多少秒"""
+        return max(0.0, self.next_allowed - asyncio.get_running_loop().time())
+
+
+class AdaptiveLimiter:
+    """
+    AIMD自适应并发限制
+    
+    请求成功且延迟没有明显升高时，每完成约一整轮（当前上限个）请求把上限加1；
+    收到429或5xx时上限减半，同一轮内的多个失败只减一次。这样无需手动调参即可逼近服务端真实可承受的并发。
+    """
+    
+    def __init__(self, initial: int, max_limit: int, min_limit: int = 1):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, initial)
+        self.limit = float(initial)
+        self._inflight = 0
+        self._latency = None  # 成功请求延迟的指数移动平均
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+    
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """占用一个并发名额，产出发送时刻，供 record() 计算延迟"""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._inflight < int(self.limit))
+            self._inflight += 1
+        try:
+            yield asyncio.get_running_loop().time()
+        finally:
+            async with self._cond:
+                self._inflight -= 1
+                self._cond.notify_all()
+    
+    def record(self, status: int, sent_at: float) -> None:
+        """根据响应状态码和延迟调整并发上限"""
+        now = asyncio.get_running_loop().time()
+        latency = now - sent_at
+        if status == 429 or status >= 500:
+            if now - self._last_decrease >= (self._latency or 1.0):
+                self.limit = max(self.min_limit, self.limit / 2)
+                self._last_decrease = now
+            return
+        if status != 200:
+            return
+        self._latency = latency if self._latency is None else 0.8 * self._latency + 0.2 * latency
+        if latency <= 2 * self._latency:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class SemanticCache:
+    """
+    语义缓存：用句向量检索与历史块近似重复的内容（仅口头语、标点不同等），直接复用其响应
+    
+    依赖 sentence-transformers、numpy 和 faiss-cpu，均在创建时才导入
+    """
+    
+    def __init__(self, cache_dir: Path, threshold: float = 0.95,
+                 model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+        import faiss
+        from sentence_transformers import SentenceTransformer
+        
+        self._faiss = faiss
+        self.threshold = threshold
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.cache_dir / 'index.faiss'
+        self.entries_path = self.cache_dir / 'entries.json'
+        
+        self.model = SentenceTransformer(model_name)
+        if self.index_path.exists() and self.entries_path.exists():
+            self.index = faiss.read_index(str(self.index_path))
+            with open(self.entries_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        else:
+            # 向量归一化后内积即余弦相似度
+            self.index = faiss.IndexFlatIP(self.model.get_sentence_embedding_dimension())
+            self.entries = []
+        
+        self._lock = threading.Lock()
+        self._dirty = False
+    
+    def _embed(self, text: str):
+        return self.model.encode([text], normalize_embeddings=True).astype('float32')
+    
+    def lookup(self, text: str) -> Optional[str]:
+        """返回相似度超过阈值的已缓存响应，没有则返回None"""
+        vec = self._embed(text)
+        with self._lock:
+            if self.index.ntotal == 0:
+                return None
+            scores, ids = self.index.search(vec, 1)
+        if scores[0, 0] >= self.threshold:
+            return self.entries[ids[0, 0]]
+        return None
+    
+    def add(self, text: str, response: str) -> None:
+        vec = self._embed(text)
+        with self._lock:
+            self.index.add(vec)
+            self.entries.append(response)
+            self._dirty = True
+    
+    def save(self) -> None:
+        """将新增条目写回磁盘"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._faiss.write_index(self.index, str(self.index_path))
+            with open(self.entries_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+            self._dirty = False
+
+
 class OptimizedSubtitleConverter:
     def __init__(self, api_key: str, config: Dict[str, Any] = None):
         """
@@ -34,16 +325,46 @@ class OptimizedSubtitleConverter:
             "model": "deepseek-chat",
             "temperature": 0.1,  # 低温度确保准确性
             "max_tokens": 8192,
+            "chunk_size": 1200,  # 每块最多包含的单词数（未启用按token分块时使用）
+            "chunk_tokens": 1500,  # 每块最多包含的输入token数，0表示按单词数分块
             "request_timeout": 600,
             "retry_attempts": 3,
-            "retry_delay": 2
+            "retry_delay": 2,
+            "concurrency": 8,  # 同时在途的API请求数（初始值，随后按响应情况自适应调整）
+            "max_concurrency": 32,  # 自适应并发的上限
+            "file_concurrency": 4,  # 批量模式下同时处理的文件数
+            "max_workers": 8,  # 读文件、写文件等阻塞操作使用的线程数，至少比同时处理的文件数多2
+            "requests_per_second": 5,  # 每秒最多发出的API请求数，0表示不限
+            "enable_cache": True,  # 本地缓存API响应，重复的块直接复用
+            "cache_dir": ".cache/converter",
+            "semantic_cache": False,  # 语义缓存，复用近似重复块的响应（需要额外依赖）
+            "semantic_threshold": 0.95,
+            "verbose": False,  # 日志文件记录DEBUG级别的详细内容
+            "stream": True  # 以SSE流式接收响应，边生成边接收
         }
         
-        self.config = {**default_config, **(config or {})}
+        config = config or {}
+        self.config = {**default_config, **config}
+        # 显式给出单词数上限而未给出token上限时，按单词数分块，不让默认的token上限覆盖用户设置
+        if 'chunk_size' in config and 'chunk_tokens' not in config:
+            self.config['chunk_tokens'] = 0
+        
+        # 所有请求共用的请求头和超时设置，不必每次请求（及每次重试）重新构造
+        self._headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        self._timeout = aiohttp.ClientTimeout(total=self.config['request_timeout'])
         
         # 失败内容收集
         self.failed_chunks = []
         
+        # 并发控制原语与事件循环绑定，在首次进入事件循环时创建
+        self._flow_loop = None
+        self.limiter = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.rate_limiter = None
+        
         # 设置日志 - 同时输出到控制台和文件
         log_dir = Path('logs')
         log_dir.mkdir(exist_ok=True)
@@ -51,14 +372,16 @@ class OptimizedSubtitleConverter:
         
         # 创建专属的logger，避免与其他logger冲突
         self.logger = logging.getLogger(f'OptimizedSubtitleConverter_{id(self)}')
-        self.logger.setLevel(logging.DEBUG)  # 设置为DEBUG级别以捕获所有日志
+        # 默认INFO级别，DEBUG日志在入口处即被过滤，不产生格式化开销；--verbose 时输出全部调试日志
+        log_level = logging.DEBUG if self.config['verbose'] else logging.INFO
+        self.logger.setLevel(log_level)
         
         # 清除可能存在的旧handlers
         self.logger.handlers.clear()
         
         # 文件handler - 使用utf-8-sig编码以便Windows记事本能正确显示
         file_handler = logging.FileHandler(log_file, encoding='utf-8-sig', mode='w')
-        file_handler.setLevel(logging.DEBUG)
+        file_handler.setLevel(log_level)
         file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
         file_handler.setFormatter(file_formatter)
         
@@ -68,18 +391,46 @@ class OptimizedSubtitleConverter:
         console_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
         console_handler.setFormatter(console_formatter)
         
-        # 添加handlers
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
+        # 添加handlers - 事件循环线程只把日志记录放入队列，格式化后的写盘与控制台输出由后台线程完成
+        log_queue = queue.SimpleQueue()
+        self.logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        self._log_handlers = (file_handler, console_handler)
+        self._log_listener = logging.handlers.QueueListener(
+            log_queue, *self._log_handlers, respect_handler_level=True
+        )
+        self._log_listener.start()
+        atexit.register(self.close)
         
         # 防止日志传播到root logger
         self.logger.propagate = False
         
         self.logger.info(f"📝 日志文件: {log_file}")
-        self.logger.debug(f"🔧 Logger初始化完成，ID: {id(self)}")
-        
-        
-        self.prompt_template = """你是专业的文档编辑专家和翻译专家, 请严格按照以下要求处理字幕文本：
+        self.logger.debug("🔧 Logger初始化完成，ID: %d", id(self))
+        
+        # 分块计量 - 安装了 tiktoken 时按BPE token数装箱，中英混排时比单词数更接近真实的请求大小
+        self._encoding = None
+        if self.config['chunk_tokens']:
+            if tiktoken is None:
+                self.logger.warning("⚠️ 未安装 tiktoken 库，退回按单词数分块 (pip install tiktoken)")
+            else:
+                try:
+                    self._encoding = tiktoken.get_encoding('cl100k_base')
+                except Exception as e:
+                    self.logger.warning(f"⚠️ 加载 tiktoken 编码失败，退回按单词数分块: {e}")
+        self.logger.info(f"✂️  分块上限: 每块{self._chunk_limit_desc()}")
+        
+        # 响应缓存 - 以 (模型, 参数, 提示词) 的SHA-256为键持久化到磁盘
+        self.cache = None
+        if self.config['enable_cache']:
+            if diskcache is None:
+                self.logger.warning("⚠️ 未安装 diskcache 库，响应缓存已禁用 (pip install diskcache)")
+            else:
+                self.cache = diskcache.Cache(self.config['cache_dir'])
+                self.logger.info(f"💾 响应缓存目录: {self.config['cache_dir']}")
+        
+        # 固定的处理要求全部放在 system 消息中，所有块的请求共享同一前缀，可命中 DeepSeek 的上下文缓存
+        self.system_prompt = """你是专业的双语文档编辑助手，翻译专家, 专注于高质量的内容整理和翻译。
+请严格按照以下要求处理字幕文本：
 
 ==== 处理要求 ====
 1. **错误修正**：识别并修正可能存在的识别错误, 确保文本准确性
@@ -117,56 +468,215 @@ Hello world. This is a test. We are learning something new.
 - 禁止添加任何解释说明、标题、序号
 - 禁止翻译不完整句子
 - 禁止自行补全截断的句子
-- 对于不完整句子的识别应采取保守策略
-
-原始文本：
+- 对于不完整句子的识别应采取保守策略"""
+        
+        # 每个块只有 user 消息不同
+        self.prompt_template = """原始文本：
 {chunk}
 
 请直接输出处理结果："""
-
-    def read_file(self, file_path: str) -> str:
-        """读取文件内容，支持多种编码"""
-        encodings = ['utf-8', 'gbk', 'gb2312', 'ascii']
+        # 模板在占位符处预先拆成前后两段，每块直接拼接，不必逐块 format 整个模板
+        self._prompt_prefix, _, self._prompt_suffix = self.prompt_template.partition('{chunk}')
         
-        self.logger.info(f"📖 开始读取文件: {file_path}")
+        # 边界优化的提示词，同样预先拆分
+        boundary_template = """你是专业的文档编辑专家。以下文本来自视频字幕的分块翻译，由于分块边界问题产生了**内容重复**。
+
+==== 核心问题 ====
+分块处理时，一个句子可能被截断：
+- 前一块翻译了句子的一部分（可能不完整）
+- 后一块又从头翻译了同一句话
+
+这导致**同一个意思被翻译了两次**，产生重复的中文段落。
+
+==== 典型重复模式 ====
+输入可能是这样的：
+```
+We talked about loss functions to quantify how happy or unhappy.
+我们讨论了用损失函数来量化满意或不满意程度。
+
+How happy or unhappy we are with different settings of the weights.
+我们对不同权重设置的满意或不满意程度。
+```
+这里"满意或不满意程度"的意思重复了。
+
+正确输出应该合并为：
+```
+We talked about loss functions to quantify how happy or unhappy we are with different settings of the weights.
+我们讨论了用损失函数来量化我们对不同权重设置的满意或不满意程度。
+```
+
+==== 你的任务 ====
+1. **识别语义重复**：找出表达相同或相似意思的段落
+2. **合并重复内容**：将重复的英文句子合并成完整句子，对应生成一个完整的中文翻译
+3. **删除冗余**：删除多余的翻译，保证每个意思只出现一次
+4. **保持格式**：英文段落 + 空行 + 中文翻译 + 空行
+
+==== 输入内容 ====
+{boundary_content}
+
+==== 输出要求 ====
+直接输出去重合并后的内容。格式：
+
+英文段落
+
+中文翻译
+
+（不要添加任何解释或标记）"""
+        self._boundary_prefix, _, self._boundary_suffix = boundary_template.partition('{boundary_content}')
         
-        for encoding in encodings:
+        # 语义缓存 - 按模型参数和提示词模板划分命名空间，配置变化时不会误用旧响应
+        self.semantic_cache = None
+        if self.config['semantic_cache']:
+            namespace = self._cache_key(self.prompt_template)[:16]
             try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    content = f.read()
-                self.logger.info(f"✅ 文件读取成功，编码: {encoding}, 长度: {len(content)}字符")
-                self.logger.debug(f"📄 文件内容预览:\n{content[:300]}...")
-                return content
-            except UnicodeDecodeError:
-                self.logger.debug(f"❌ 编码 {encoding} 读取失败，尝试下一个...")
-                continue
+                self.semantic_cache = SemanticCache(
+                    Path(self.config['cache_dir']) / 'semantic' / namespace,
+                    self.config['semantic_threshold']
+                )
+                self.logger.info(f"🧠 语义缓存已启用，已有 {len(self.semantic_cache.entries)} 条记录")
+            except ImportError as e:
+                self.logger.warning(f"⚠️ 语义缓存依赖缺失，已禁用: {e} (pip install sentence-transformers faiss-cpu)")
+
+    def close(self):
+        """停止后台日志线程并刷新、关闭日志文件，可重复调用"""
+        if self._log_listener is None:
+            return
+        self._log_listener.stop()
+        self._log_listener = None
+        for handler in self._log_handlers:
+            handler.close()
+
+    def _detect_encoding(self, file_path: str) -> str:
+        """
+        确定文件编码，不把整个文件读入内存
         
-        self.logger.error(f"❌ 无法读取文件，尝试的所有编码均失败: {encodings}")
-        raise ValueError(f"无法读取文件 {file_path}，尝试的编码: {encodings}")
+        先按块增量校验 UTF-8（绝大多数字幕文件），失败时再用 charset_normalizer 对文件开头做统计探测
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            with open(file_path, 'rb') as f:
+                while block := f.read(64 * 1024):
+                    decoder.decode(block)
+            decoder.decode(b'', final=True)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            self.logger.debug("❌ 非UTF-8编码，开始探测...")
+        
+        with open(file_path, 'rb') as f:
+            head = f.read(64 * 1024)
+        best = from_bytes(head).best()
+        if best is None:
+            self.logger.error(f"❌ 无法识别文件编码: {file_path}")
+            raise ValueError(f"无法读取文件 {file_path}，无法识别编码")
+        return best.encoding
+
+    def iter_chunks(self, file_path: str) -> Iterator[str]:
+        """逐行流式读取文件并按句子边界产出文本块，内存占用与块大小相当而非文件大小"""
+        encoding = self._detect_encoding(file_path)
+        self.logger.info(f"📖 流式读取文件: {file_path}, 编码: {encoding}")
+        self.logger.info(f"📊 分块配置: 每块最多{self._chunk_limit_desc()}，按句子边界切分")
+        
+        # 编码只由文件开头探测得出，后文个别无法解码的字节以替换字符代替，不让整个文件失败
+        with open(file_path, 'r', encoding=encoding, errors='replace') as f:
+            yield from self._pack_sentences(iter_sentences(f))
     
     
     def strip_content(self, content: str) -> str:
         """清理AI返回的内容"""
         return content.strip()
 
+    def _trivial(self, chunk: str) -> Optional[str]:
+        """
+        判断块是否只有静音/音乐标注或重复的填充词
+        
+        Returns:
+            琐碎块原样返回（不调用API），否则返回None
+        """
+        return chunk if is_trivial(chunk) else None
+
+    def _cache_key(self, prompt: str) -> str:
+        """根据模型参数和完整提示词生成缓存键"""
+        key_source = (
+            f"{self.config['model']}|{self.config['temperature']}|{self.config['max_tokens']}|"
+            f"{self.system_prompt}|{prompt}"
+        )
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def _ensure_flow_control(self):
+        """为当前事件循环创建并发控制原语（asyncio原语不能跨事件循环复用）"""
+        loop = asyncio.get_running_loop()
+        if self._flow_loop is loop:
+            return
+        self._flow_loop = loop
+        self.limiter = AdaptiveLimiter(self.config['concurrency'], self.config['max_concurrency'])
+        self._inflight = {}
+        self.rate_limiter = RateLimiter(self.config['requests_per_second'])
+
     async def process_chunk_async(self, session: aiohttp.ClientSession, chunk: str, chunk_index: int) -> tuple:
         """异步处理单个文本块"""
         
-        self.logger.debug(f"📤 开始处理块 {chunk_index + 1}, 输入长度: {len(chunk)}字符")
-        self.logger.debug(f"📤 输入内容预览: '{chunk[:200]}...'")
+        self.logger.debug("📤 开始处理块 %d, 输入长度: %d字符", chunk_index + 1, len(chunk))
+        self.logger.debug("📤 输入内容预览: '%.200s...'", chunk)
         
+        prompt = self._prompt_prefix + chunk + self._prompt_suffix
+        self.logger.debug("🔧 生成的提示词长度: %d字符", len(prompt))
+        
+        # 先查缓存，命中则无需请求API
+        cache_key = self._cache_key(prompt)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.logger.info(f"💾 块 {chunk_index + 1} 命中缓存")
+                return (chunk_index, cached)
+        
+        # 相同内容的请求正在进行中（如批量模式下其他文件的相同片段），直接共享其结果；
+        # 发起该请求的任务被取消时不继承其取消，重新检查后自己发起请求
+        while (inflight := self._inflight.get(cache_key)) is not None:
+            self.logger.info(f"♻️ 块 {chunk_index + 1} 与在途请求内容相同，等待其结果")
+            try:
+                return (chunk_index, await asyncio.shield(inflight))
+            except _InflightCancelled:
+                self.logger.info(f"🔁 块 {chunk_index + 1} 等待的在途请求已取消，重新发起")
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            cached = None
+            if self.semantic_cache is not None:
+                cached = await asyncio.to_thread(self.semantic_cache.lookup, chunk)
+            if cached is not None:
+                self.logger.info(f"🧠 块 {chunk_index + 1} 命中语义缓存")
+                result = (chunk_index, cached)
+            else:
+                result = await self._request_chunk(session, chunk, chunk_index, prompt, cache_key)
+            future.set_result(result[1])
+            return result
+        except asyncio.CancelledError:
+            # 只取消自己，等待者收到普通异常后重试
+            future.set_exception(_InflightCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他请求等待时，避免出现 "Future exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._inflight[cache_key]
+
+    async def _request_chunk(self, session: aiohttp.ClientSession, chunk: str, chunk_index: int,
+                             prompt: str, cache_key: str) -> tuple:
+        """请求API处理单个文本块，按错误类型退避重试；彻底失败时保留原始内容"""
         for attempt in range(self.config['retry_attempts']):
             try:
-                prompt = self.prompt_template.format(chunk=chunk)
-                self.logger.debug(f"🔧 生成的提示词长度: {len(prompt)}字符")
-                self.logger.debug(f"📤 发送给AI的完整内容:\n{'='*80}\n{prompt}\n{'='*80}")
+                self.logger.debug("📤 发送给AI的完整内容:\n%s", prompt)
                 
                 payload = {
                     "model": self.config['model'],
                     "messages": [
                         {
                             "role": "system",
-                            "content": "你是专业的双语文档编辑助手，翻译专家, 专注于高质量的内容整理和翻译。"
+                            "content": self.system_prompt
                         },
                         {
                             "role": "user",
@@ -174,59 +684,65 @@ Hello world. This is a test. We are learning something new.
                         }
                     ],
                     "temperature": self.config['temperature'],
-                    "max_tokens": self.config['max_tokens']
-                }
-                
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
+                    "max_tokens": self.config['max_tokens'],
+                    "stream": self.config['stream']
                 }
                 
-                timeout = aiohttp.ClientTimeout(total=self.config['request_timeout'])
+                await self.rate_limiter.acquire()
+                self.logger.debug("🌐 发送API请求到 %s", self.base_url)
                 
-                self.logger.debug(f"🌐 发送API请求到 {self.base_url}")
-                
-                async with session.post(
-                    self.base_url,
-                    json=payload,
-                    headers=headers,
-                    timeout=timeout
-                ) as response:
-                    
-                    self.logger.debug(f"📡 收到响应，状态码: {response.status}")
-                    
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'choices' in result and result['choices']:
-                            raw_content = result['choices'][0]['message']['content'].strip()
-                            self.logger.debug(f"🤖 AI原始返回长度: {len(raw_content)}字符")
-                            self.logger.debug(f"🤖 AI返回的完整内容:\n{'='*80}\n{raw_content}\n{'='*80}")
-                            
-                            # 清理内容
-                            content = self.strip_content(raw_content)
-                            self.logger.debug(f"🧹 清理后长度: {len(content)}字符")
-                            
-                            # 检查是否包含不完整句子标记
-                            if '[不完整句子:' in content:
-                                self.logger.info(f"🔗 AI检测到不完整句子在块 {chunk_index + 1}")
+                async with self.limiter.slot() as sent_at:
+                    async with session.post(
+                        self.base_url,
+                        data=orjson.dumps(payload),
+                        headers=self._headers,
+                        timeout=self._timeout
+                    ) as response:
+                        
+                        self.logger.debug("📡 收到响应，状态码: %d", response.status)
+                        self.limiter.record(response.status, sent_at)
+                        self.rate_limiter.update_from_headers(response.headers)
+                        
+                        if response.status == 200:
+                            if self.config['stream']:
+                                result = await self._read_stream(response)
                             else:
-                                self.logger.debug(f"✅ 块 {chunk_index + 1} 无不完整句子")
-                            
-                            self.logger.info(f"✅ 完成块 {chunk_index + 1}")
-                            return (chunk_index, content)
+                                result = orjson.loads(await response.read())
+                            if 'choices' in result and result['choices']:
+                                raw_content = result['choices'][0]['message']['content'].strip()
+                                self.logger.debug("🤖 AI原始返回长度: %d字符", len(raw_content))
+                                self.logger.debug("🤖 AI返回的完整内容:\n%s", raw_content)
+                                
+                                # 清理内容
+                                content = self.strip_content(raw_content)
+                                self.logger.debug("🧹 清理后长度: %d字符", len(content))
+                                
+                                # 检查是否包含不完整句子标记
+                                if '[不完整句子:' in content:
+                                    self.logger.info(f"🔗 AI检测到不完整句子在块 {chunk_index + 1}")
+                                else:
+                                    self.logger.debug("✅ 块 %d 无不完整句子", chunk_index + 1)
+                                
+                                if self.cache is not None:
+                                    self.cache.set(cache_key, content)
+                                if self.semantic_cache is not None:
+                                    await asyncio.to_thread(self.semantic_cache.add, chunk, content)
+                                
+                                self.logger.info(f"✅ 完成块 {chunk_index + 1}")
+                                return (chunk_index, content)
+                            else:
+                                raise Exception(f"API响应格式错误: {result}")
                         else:
-                            raise Exception(f"API响应格式错误: {result}")
-                    else:
-                        error_text = await response.text()
-                        self.logger.error(f"API错误详情 - 状态码: {response.status}, 响应: {error_text}")
-                        raise Exception(f"API错误 {response.status}: {error_text}")
-                        
+                            error_text = await response.text()
+                            self.logger.error(f"API错误详情 - 状态码: {response.status}, 响应: {error_text}")
+                            raise APIError(response.status, error_text)
+                            
             except Exception as e:
-                wait_time = self.config['retry_delay'] * (2 ** attempt)
+                wait_time = self._retry_wait(e, attempt)
                 self.logger.warning(f"块 {chunk_index + 1} 失败 (第{attempt + 1}次): {e}")
                 
                 if attempt < self.config['retry_attempts'] - 1:
-                    self.logger.info(f"等待 {wait_time} 秒后重试...")
+                    self.logger.info(f"等待 {wait_time:.1f} 秒后重试...")
                     await asyncio.sleep(wait_time)
                 else:
                     self.logger.error(f"块 {chunk_index + 1} 彻底失败，保留原始内容")
@@ -237,27 +753,132 @@ Hello world. This is a test. We are learning something new.
                         'error': str(e)
                     }
                     self.failed_chunks.append(failed_chunk_info)
-                    return (chunk_index, f"# 处理失败的内容\n\n{chunk}")
+                    return (chunk_index, f"{_FAILED_CHUNK_HEADER}\n\n{chunk}")
 
-    def split_text(self, text: str) -> List[str]:
-        """分割文本为块"""
-        chunk_size = self.config['chunk_size']
-        words = text.split()
-        self.logger.info(f"📊 文本统计: 总字符数={len(text)}, 总单词数={len(words)}")
-        self.logger.info(f"📊 分块配置: 每块{chunk_size}单词")
+    async def _read_stream(self, response: aiohttp.ClientResponse) -> Dict[str, Any]:
+        """
+        逐帧读取SSE流式响应，拼接为与非流式响应相同结构的结果
         
-        chunks = []
+        边接收边检查不完整句子标记，标记内容过长仍未闭合时提前中断，交给重试
+        """
+        marker = '[不完整句子:'
+        content = ""
+        marker_at = -1
+        marker_checked = False
+        async for line in response.content:
+            if not line.startswith(b'data:'):
+                continue
+            data = line[5:].strip()
+            if data == b'[DONE]':
+                break
+            choices = orjson.loads(data).get('choices')
+            if not choices:
+                continue
+            delta = choices[0].get('delta', {}).get('content')
+            if not delta:
+                continue
+            
+            content += delta
+            if marker_at < 0:
+                # 标记可能跨帧，从新内容之前一小段开始查找
+                marker_at = content.find(marker, max(0, len(content) - len(delta) - len(marker)))
+            elif not marker_checked and len(content) - marker_at > _MAX_INCOMPLETE_CHARS:
+                if content.find(']', marker_at) < 0:
+                    raise ValueError(f"不完整句子标记超过{_MAX_INCOMPLETE_CHARS}字符仍未闭合，中断流式响应")
+                marker_checked = True
+        return {'choices': [{'message': {'content': content}}]}
 
-        for i in range(0, len(words), chunk_size):
-            chunk = ' '.join(words[i:i + chunk_size])
-            chunks.append(chunk)
-            self.logger.debug(f"✂️  块 {len(chunks)}: {len(chunk)}字符, {len(chunk.split())}单词")
+    def _retry_wait(self, error: Exception, attempt: int) -> float:
+        """
+        按错误类型决定重试前的等待时间
+        
+        429 按服务端 Retry-After 等待（所有请求在限流器处一起暂停，这里不再叠加退避），
+        5xx 指数退避，连接错误和超时短暂随机退避后即可重试
+        """
+        base = self.config['retry_delay']
+        if isinstance(error, APIError) and error.status == 429:
+            if self.rate_limiter.pause_remaining() > 0:
+                return 0.0
+            return base * (2 ** attempt)
+        if isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+            return base * random.uniform(0.5, 1.5)
+        return base * (2 ** attempt)
+
+    def _chunk_limit_desc(self) -> str:
+        if self._encoding is not None:
+            return f"{self.config['chunk_tokens']}个token"
+        return f"{self.config['chunk_size']}单词"
+
+    def _measure(self, text: str, words: List[str]) -> int:
+        """文本的分块计量：按token分块时为BPE token数，否则为单词数"""
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return len(words)
+
+    def _pack_sentences(self, sentences: Iterable[str]) -> Iterator[str]:
+        """
+        把句子装箱为文本块
+        
+        把完整句子依次装入当前块，直到再装一句就会超过每块的token数（或单词数）上限，
+        这样各块都在句末结束、可以独立并发翻译；没有标点的超长句（常见于自动生成字幕）
+        按其平均每词token数换算出单词数后硬切，由不完整句子标记和边界优化兜底。
+        """
+        limit = self.config['chunk_tokens'] if self._encoding is not None else self.config['chunk_size']
+        buffer = []
+        size = 0
+        chunk_count = 0
+        
+        def emit(words: List[str], measured: int) -> str:
+            nonlocal chunk_count
+            chunk = ' '.join(words)
+            chunk_count += 1
+            self.logger.debug("✂️  块 %d: %d字符, %d单词, 计量%d", chunk_count, len(chunk), len(words), measured)
+            return chunk
+        
+        for sentence in sentences:
+            words = sentence.split()
+            if not words:
+                continue
+            
+            cost = self._measure(sentence, words)
+            if buffer and size + cost > limit:
+                yield emit(buffer, size)
+                buffer.clear()
+                size = 0
+            
+            if cost > limit:
+                # 走到这里时缓冲区必为空，整段切片直接产出，只有末尾不足一块的部分进入缓冲区
+                step = max(1, len(words) * limit // cost)
+                full = len(words) - len(words) % step
+                for i in range(0, full, step):
+                    yield emit(words[i:i + step], limit)
+                buffer.extend(words[full:])
+                if buffer:
+                    size = self._measure(' '.join(buffer), buffer) if self._encoding is not None else len(buffer)
+                continue
+            
+            buffer.extend(words)
+            size += cost
+        
+        if buffer:
+            yield emit(buffer, size)
 
-        self.logger.info(f"✂️  分割完成: 共{len(chunks)}块")
-        return chunks
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享API会话；块请求的并发由信号量控制，连接池留出余量，边界优化等请求不必排队等连接"""
+        return await get_session(max(16, self.config['max_concurrency']))
 
-    async def process_file_async(self, input_file: str, output_file: str = None):
-        """异步顺序处理文件"""
+    async def process_file_async(self, input_file: str, output_file: str = None,
+                                 session: Optional[aiohttp.ClientSession] = None):
+        """
+        异步并发处理文件
+        
+        Args:
+            session: API会话；为空时使用共享会话，由调用方在全部处理结束后 close_session()
+        """
+        self._ensure_flow_control()
+        if session is None:
+            session = await self._get_session()
+        
         if not os.path.exists(input_file):
             raise FileNotFoundError(f"找不到文件: {input_file}")
         
@@ -268,104 +889,293 @@ Hello world. This is a test. We are learning something new.
         self.logger.info(f"🚀 开始处理: {input_file}")
         self.logger.info(f"📁 输出文件: {output_file}")
         
-        # 读取和分割文件
-        content = self.read_file(input_file)
-        chunks = self.split_text(content)
-        total_chunks = len(chunks)
-        
-        self.logger.info(f"📊 智能分割为 {total_chunks} 块")
-        self.logger.info(f"🔄 使用顺序处理模式")
+        self.logger.info(f"🔄 使用并发处理模式，并发数: {self.config['concurrency']}")
         
         start_time = time.time()
         
-        # 顺序处理并处理不完整句子
-        processed_chunks = await self.process_chunks_sequentially(chunks)
+        # 边读取分块边并发处理；成功的块同步记入进度文件，中断后重跑可从断点继续
+        progress_file = Path(output_file).with_suffix('.progress.jsonl')
+        if self.config.get('enable_boundary_optimization', False):
+            total_chunks, has_failed = await self._process_to_memory(session, input_file, output_file, progress_file)
+        else:
+            total_chunks, has_failed = await self._process_streaming(session, input_file, output_file, progress_file)
         
         # 记录失败的块
         if self.failed_chunks:
-            self.logger.warning(f"⚠️  有 {len(self.failed_chunks)} 个块处理失败")
+            self.logger.warning(f"⚠️  累计有 {len(self.failed_chunks)} 个块处理失败")
+        
+        # 全部块都成功时不再需要进度文件；有失败块时保留，重跑只需补齐失败的块
+        if not has_failed:
+            progress_file.unlink(missing_ok=True)
+        
+        elapsed_time = time.time() - start_time
+        self.logger.info(f"🎉 处理完成！")
+        self.logger.info(f"⏱️  用时: {elapsed_time:.1f} 秒")
+        self.logger.info(f"📈 平均速度: {total_chunks/elapsed_time:.1f} 块/秒")
+        
+        return output_file
+
+    async def _process_to_memory(self, session: aiohttp.ClientSession, input_file: str,
+                                 output_file: str, progress_file: Path) -> tuple:
+        """
+        处理全部块后合并成完整文档，做边界优化再一次写入
+        
+        Returns:
+            (块数, 是否有失败的块)
+        """
+        processed_chunks = await self.process_chunks_concurrently(
+            session, self.iter_chunks(input_file), progress_file
+        )
+        self.logger.info(f"📊 智能分割为 {len(processed_chunks)} 块")
         
         # 合并内容并获取分割位置
         final_content, split_positions = self.merge_content(processed_chunks)
         
-        # 边界优化（如果启用）
-        if self.config.get('enable_boundary_optimization', False) and split_positions:
+        if split_positions:
             self.logger.info(f"🔧 开始边界优化，共 {len(split_positions)} 个分割点...")
             try:
-                final_content = await self.optimize_boundaries_async(final_content, split_positions)
+                final_content = await self.optimize_boundaries_async(session, final_content, split_positions)
                 self.logger.info("✅ 边界优化完成")
             except Exception as e:
                 self.logger.warning(f"⚠️ 边界优化失败: {e}")
         
-        # 写入文件
+        # 写入文件（放到线程中，不阻塞其他文件的在途请求）
+        await asyncio.to_thread(Path(output_file).write_text, final_content, encoding='utf-8')
+        
+        has_failed = any(chunk.startswith(_FAILED_CHUNK_HEADER) for chunk in processed_chunks)
+        return len(processed_chunks), has_failed
+
+    async def _process_streaming(self, session: aiohttp.ClientSession, input_file: str,
+                                 output_file: str, progress_file: Path) -> tuple:
+        """
+        不做边界优化时，块按顺序完成一个就清理并追加写入一个，内存中不保留整篇文档
+        
+        Returns:
+            (块数, 是否有失败的块)
+        """
+        written = 0
+        has_failed = False
+        
         with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(final_content)
+            def write_chunk(content: str) -> None:
+                nonlocal written, has_failed
+                has_failed = has_failed or content.startswith(_FAILED_CHUNK_HEADER)
+                content = self._cleanup_chunk(content)
+                if not content:
+                    return
+                if written:
+                    f.write("\n\n")
+                f.write(content)
+                written += 1
+            
+            await self.process_chunks_concurrently(
+                session, self.iter_chunks(input_file), progress_file, sink=write_chunk
+            )
         
-        elapsed_time = time.time() - start_time
-        self.logger.info(f"🎉 处理完成！")
-        self.logger.info(f"⏱️  用时: {elapsed_time:.1f} 秒")
-        self.logger.info(f"📈 平均速度: {total_chunks/elapsed_time:.1f} 块/秒")
+        self.logger.info(f"📊 共写出 {written} 块")
+        return written, has_failed
+
+    def _load_progress(self, progress_file: Path) -> Dict[str, str]:
+        """读取进度文件中已成功处理的块（块哈希 -> 处理结果），崩溃时写了一半的末行直接忽略"""
+        done = {}
+        if not progress_file.exists():
+            return done
+        with open(progress_file, 'rb') as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+                if 'k' in record:
+                    done[record['k']] = record['content']
+        return done
+
+    def _fill_queue(self, chunks: Iterable[str], chunk_queue: asyncio.Queue,
+                    loop: asyncio.AbstractEventLoop, workers: int, stop: threading.Event) -> None:
+        """
+        在工作线程中逐块产出 (索引, 块) 放入队列，结束（含出错）时为每个 worker 放入结束标记
         
-        return output_file
+        stop 被设置（worker 出错或任务被取消，不会再有人消费队列）时放弃正在等待的入队并立即返回，
+        线程不会永远阻塞在满队列上
+        """
+        def put(item) -> bool:
+            future = asyncio.run_coroutine_threadsafe(chunk_queue.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=_PRODUCER_POLL_SECONDS)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        return False
+                except concurrent.futures.CancelledError:
+                    return False
+        
+        try:
+            for item in enumerate(chunks):
+                if stop.is_set() or not put(item):
+                    return
+        finally:
+            for _ in range(workers):
+                if stop.is_set() or not put(None):
+                    break
 
-    async def process_chunks_sequentially(self, chunks: List[str]) -> List[str]:
-        """顺序处理文本块，处理不完整句子传递"""
+    async def process_chunks_concurrently(self, session: aiohttp.ClientSession,
+                                          chunks: Iterable[str],
+                                          progress_file: Optional[Path] = None,
+                                          sink: Optional[Callable[[str], None]] = None) -> List[str]:
+        """
+        并发处理文本块
+        
+        各块互不依赖地并发请求，由信号量限制同时在途的请求数；chunks 可以是逐步产出的迭代器，
+        每得到一块就立即发出请求。块末尾的不完整句子以独立段落保留在该块结尾，交由边界优化与下一块开头合并。
+        
+        Args:
+            progress_file: JSONL进度文件，每个成功的块按块哈希追加一行；中断后重跑时直接复用其中已完成的块，
+                修改分块大小后块的序号虽然变了，内容未变的块仍能命中
+            sink: 给定时按顺序把整理好的块逐个交给它（如边处理边写入文件），不在内存中累积，返回空列表
+        """
+        skipped = 0
+        done = {}
+        progress = None
+        # 进度文件的写入都在线程中进行；加锁保证整行写入，并且关闭后被取消的 worker 残留的写入会被跳过
+        progress_lock = threading.Lock()
+        
+        def append_progress(line: bytes) -> None:
+            with progress_lock:
+                if not progress.closed:
+                    progress.write(line)
+                    progress.flush()
+        
+        if progress_file is not None:
+            done = await asyncio.to_thread(self._load_progress, progress_file)
+            if done:
+                self.logger.info(f"⏯️ 从进度文件恢复 {len(done)} 个已完成的块: {progress_file}")
+            progress = open(progress_file, 'ab')
+            if progress.tell():
+                # 上次中断时末行可能只写了一半，先换行，避免新记录与其粘连
+                progress.write(b'\n')
+        
+        async def run_chunk(i: int, chunk: str, ckpt_key: str) -> tuple:
+            nonlocal skipped
+            if ckpt_key in done:
+                return (i, done[ckpt_key])
+            if (passthrough := self._trivial(chunk)) is not None:
+                skipped += 1
+                self.logger.debug("⏭️ 块 %d 仅含标注或填充词，跳过API调用", i + 1)
+                return (i, passthrough)
+            self.logger.info(f"🔄 开始处理块 {i+1}")
+            self.logger.debug("📝 当前块开头: '%.100s...'", chunk)
+            try:
+                result = await self.process_chunk_async(session, chunk, i)
+            except Exception as e:
+                self.logger.error(f"❌ 块 {i+1} 处理失败: {e}")
+                return (i, f"{_FAILED_CHUNK_HEADER}\n\n{chunk}")
+            if progress is not None and not result[1].startswith(_FAILED_CHUNK_HEADER):
+                await asyncio.to_thread(append_progress, orjson.dumps({'k': ckpt_key, 'content': result[1]}) + b'\n')
+            return result
+        
+        # 已完成的块按索引顺序交出：末尾的不完整句子以独立段落留在块尾，交由边界优化与下一块开头合并；
+        # 每块都要等下一块到达后才交出，最后一块末尾的不完整句子另作标记
         processed_chunks = []
-        incomplete_sentence = ""
+        held = None
+        next_index = 0
         
-        connector = aiohttp.TCPConnector(limit=1, limit_per_host=1)
+        def deliver(content: str) -> None:
+            if sink is None:
+                processed_chunks.append(content)
+            else:
+                sink(content)
         
-        async with aiohttp.ClientSession(connector=connector) as session:
-            for i, chunk in enumerate(chunks):
-                self.logger.info(f"\n{'='*60}")
-                self.logger.info(f"🔄 开始处理块 {i+1}/{len(chunks)}")
-                
-                original_chunk = chunk
-                # 如果有不完整句子，添加到当前块开头
-                if incomplete_sentence:
-                    chunk = incomplete_sentence + " " + chunk
-                    self.logger.info(f"📎 块 {i+1} 合并了前一块的不完整句子")
-                    self.logger.debug(f"🔗 不完整句子: '{incomplete_sentence[:100]}...'")
-                    self.logger.debug(f"📝 原始块开头: '{original_chunk[:100]}...'")
-                    self.logger.debug(f"� 合并后块开头: '{chunk[:100]}...'")
-                else:
-                    self.logger.debug(f"📝 当前块开头: '{chunk[:100]}...'")
-                
-                self.logger.info(f"📊 当前块统计: {len(chunk)}字符, {len(chunk.split())}单词")
-                
-                # 处理当前块
-                try:
-                    result = await self.process_chunk_async(session, chunk, i)
-                    index, content = result
-
-                    self.logger.info(f"✅ 块 {i+1} 处理成功，返回内容长度: {len(content)}字符")
-                    
-                    # 检查是否有不完整句子
-                    content, new_incomplete = self.extract_incomplete_sentence(content)
-                    
-                    self.logger.debug(f"📊 处理后内容长度: {len(content)}字符")
-                    processed_chunks.append(content)
-                    
-                    # 更新不完整句子状态
-                    if new_incomplete:
-                        self.logger.info(f"🔗 提取到不完整句子: '{new_incomplete[:80]}...'")
-                        self.logger.info(f"� 将传递给块 {i+2}")
-                        incomplete_sentence = new_incomplete
-                    else:
-                        if incomplete_sentence:
-                            self.logger.info(f"✅ 前一个不完整句子已处理完成")
-                        incomplete_sentence = ""
-                    
-                except Exception as e:
-                    self.logger.error(f"❌ 块 {i+1} 处理失败: {e}")
-                    processed_chunks.append(f"# 处理失败的内容\n\n{chunk}")
-                    incomplete_sentence = ""  # 重置不完整句子
+        # 只有边界优化会把块尾的不完整句子与下一块开头合并翻译；未启用时不能把未翻译的原文片段写进输出
+        join_at_boundary = self.config.get('enable_boundary_optimization', False)
         
-        # 处理最后可能剩余的不完整句子
-        if incomplete_sentence:
-            self.logger.warning(f"⚠️  文件末尾存在未处理的不完整句子: {incomplete_sentence}")
-            if processed_chunks:
-                processed_chunks[-1] += f"\n\n[文件末尾不完整句子: {incomplete_sentence}]"
+        def keep_incomplete(index: int, content: str, incomplete_sentence: str) -> str:
+            if not incomplete_sentence:
+                return content
+            if not join_at_boundary:
+                self.logger.warning(f"⚠️  块 {index+1} 末尾的不完整句子未翻译，已移除（启用边界优化可合并处理）: "
+                                    f"'{incomplete_sentence[:80]}...'")
+                return content
+            self.logger.info(f"🔗 块 {index+1} 末尾的不完整句子保留至边界处: '{incomplete_sentence[:80]}...'")
+            return f"{content}\n\n{incomplete_sentence}" if content else incomplete_sentence
+        
+        def release() -> None:
+            nonlocal held, next_index
+            while next_index in chunk_keys and outcomes.get(chunk_keys[next_index]) is not None:
+                key = chunk_keys[next_index]
+                content = outcomes[key]
+                waiting[key] -= 1
+                if sink is not None and not waiting[key]:
+                    # 已写出的结果不再留在内存中，后文再出现相同的块时由响应缓存命中
+                    del outcomes[key]
+                self.logger.info(f"✅ 块 {next_index+1} 处理成功，返回内容长度: {len(content)}字符")
+                
+                if held is not None:
+                    deliver(keep_incomplete(*held))
+                held = (next_index, *self.extract_incomplete_sentence(content))
+                next_index += 1
+        
+        # 生产者线程边读取边分块，放入有界队列；worker 协程并发消费，队列满时生产者等待，内存中只保留少量待处理块。
+        # 文件内完全相同的块只请求一次，结果回填到每个出现位置
+        workers = self.config['max_concurrency']
+        chunk_queue = asyncio.Queue(maxsize=2 * workers)
+        chunk_keys = {}
+        outcomes = {}
+        waiting = {}
+        requested = 0
+        
+        async def worker():
+            nonlocal requested
+            while (item := await chunk_queue.get()) is not None:
+                i, chunk = item
+                # 哈希包含模型名，换模型重跑时不会复用进度文件中旧模型的结果
+                key = hashlib.blake2b((self.config['model'] + chunk).encode('utf-8'), digest_size=16).hexdigest()
+                chunk_keys[i] = key
+                waiting[key] = waiting.get(key, 0) + 1
+                if key not in outcomes:
+                    # 先占位，请求在途期间到达的重复块不会再发起请求
+                    outcomes[key] = None
+                    requested += 1
+                    outcomes[key] = (await run_chunk(i, chunk, key))[1]
+                release()
+        
+        stop = threading.Event()
+        producer = asyncio.ensure_future(asyncio.to_thread(
+            self._fill_queue, chunks, chunk_queue, asyncio.get_running_loop(), workers, stop
+        ))
+        worker_tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+        try:
+            # 任一 worker（含 sink 写文件）或生产者出错时立即停止其余任务，不再等待全部结束
+            finished, _ = await asyncio.wait([producer, *worker_tasks], return_when=asyncio.FIRST_EXCEPTION)
+            for finished_task in finished:
+                finished_task.result()
+        finally:
+            # 出错或被取消时：通知生产者线程退出，取消 worker 并等它们真正结束，
+            # 之后不会再有 worker 调用 sink（调用方随后会关闭输出文件）
+            stop.set()
+            for task in worker_tasks:
+                task.cancel()
+            await asyncio.gather(producer, *worker_tasks, return_exceptions=True)
+            if progress is not None:
+                with progress_lock:
+                    progress.close()
+        total_chunks = len(chunk_keys)
+        if requested < total_chunks:
+            self.logger.info(f"♻️ 去重: {total_chunks} 块中有 {total_chunks - requested} 块与前文重复，复用结果")
+        if skipped:
+            self.logger.info(f"⏭️ SKIP: {skipped}/{total_chunks} 个琐碎块未调用API，原样保留")
+        
+        if self.semantic_cache is not None:
+            await asyncio.to_thread(self.semantic_cache.save)
+        
+        if held is not None:
+            _, content, incomplete_sentence = held
+            if incomplete_sentence:
+                # 最后一块之后没有下一块可以合并
+                self.logger.warning(f"⚠️  文件末尾存在未处理的不完整句子: {incomplete_sentence}")
+                content += f"\n\n[文件末尾不完整句子: {incomplete_sentence}]"
+            deliver(content)
         
         return processed_chunks
     
@@ -375,24 +1185,20 @@ Hello world. This is a test. We are learning something new.
             self.logger.debug("⚠️  内容为空，跳过不完整句子检查")
             return content, ""
         
-        self.logger.debug(f"🔍 检查不完整句子标记，内容长度: {len(content)}字符")
-        self.logger.debug(f"🔍 内容预览: '{content[:300]}...'")
+        self.logger.debug("🔍 检查不完整句子标记，内容长度: %d字符", len(content))
+        self.logger.debug("🔍 内容预览: '%.300s...'", content)
         
-        # 查找不完整句子标记
-        incomplete_pattern = r'\[不完整句子:\s*([^\]]+)\]'
-        match = re.search(incomplete_pattern, content)
+        # 查找并移除不完整句子标记
+        clean_content, incomplete_sentence = split_incomplete(content)
         
-        if match:
-            incomplete_sentence = match.group(1).strip()
-            self.logger.info(f"🔗 发现不完整句子标记!")
-            self.logger.info(f"🔗 不完整句子内容: '{incomplete_sentence[:150]}...'")
-            self.logger.debug(f"🔗 不完整句子长度: {len(incomplete_sentence)}字符")
+        if incomplete_sentence:
+            self.logger.info("🔗 发现不完整句子标记!")
+            self.logger.info("🔗 不完整句子内容: '%.150s...'", incomplete_sentence)
+            self.logger.debug("🔗 不完整句子长度: %d字符", len(incomplete_sentence))
             
-            # 从内容中移除不完整句子标记
-            clean_content = re.sub(incomplete_pattern, '', content).strip()
-            self.logger.debug(f"🧹 移除标记前长度: {len(content)}字符")
-            self.logger.debug(f"🧹 移除标记后长度: {len(clean_content)}字符")
-            self.logger.debug(f"🧹 清理后内容预览: '{clean_content[:200]}...'")
+            self.logger.debug("🧹 移除标记前长度: %d字符", len(content))
+            self.logger.debug("🧹 移除标记后长度: %d字符", len(clean_content))
+            self.logger.debug("🧹 清理后内容预览: '%.200s...'", clean_content)
             return clean_content, incomplete_sentence
         else:
             self.logger.debug("✅ 未发现不完整句子标记")
@@ -428,7 +1234,7 @@ Hello world. This is a test. We are learning something new.
         
         self.logger.info(f"🔗 合并后总长度: {len(content)}字符")
         self.logger.info(f"🔗 记录了 {len(split_positions)} 个分割位置")
-        self.logger.debug(f"🔗 分割位置: {split_positions[:10]}..." if len(split_positions) > 10 else f"🔗 分割位置: {split_positions}")
+        self.logger.debug("🔗 分割位置: %s%s", split_positions[:10], "..." if len(split_positions) > 10 else "")
         
         # 最终清理
         self.logger.info("🧹 开始最终清理...")
@@ -441,167 +1247,89 @@ Hello world. This is a test. We are learning something new.
         """最终内容清理"""
         self.logger.info("🧹 开始最终清理...")
         self.logger.info(f"🧹 清理前内容长度: {len(content)} 字符")
-        self.logger.debug(f"🧹 清理前内容开头:\n{content[:500]}...")
+        self.logger.debug("🧹 清理前内容开头:\n%.500s...", content)
         
-        # 查找所有方括号内容并分类处理
-        brackets_content = re.findall(r'\[[^\]]*\]', content)
-        if brackets_content:
-            self.logger.info(f"🔍 发现方括号内容: {len(brackets_content)} 个")
-            for i, bracket in enumerate(brackets_content[:5]):  # 显示前5个
-                self.logger.debug(f"  📋 方括号 {i+1}: {bracket[:100]}...")
-        else:
+        if '[' not in content:
+            # 格式标记和长方括号块都以 [ 开头，没有 [ 时整段正则清理可以跳过
             self.logger.info("✅ 未发现方括号内容")
+        else:
+            content = self._strip_bracket_markers(content)
         
-        # 只移除特定的格式标记和不完整句子标记，但保留其他可能有用的标记
-        format_markers = [
-            r'\[英文整理段落\]',
-            r'\[对应中文翻译\]', 
-            r'\[如有不完整句子\]',
-            r'\[不完整句子:[^\]]*\]',
-            r'\[文件末尾不完整句子:[^\]]*\]',
-            r'\[不完整句子\]'
-        ]
+        self.logger.info(f"📊 移除格式标记后长度: {len(content)} 字符")
         
-        self.logger.info(f"🔧 准备移除 {len(format_markers)} 种格式标记")
+        # 确保标题格式正确，清理多余的空行和首尾空行
+        before_len = len(content)
+        content = normalize_layout(content)
+        if len(content) != before_len:
+            self.logger.debug("🔧 整理标题与空行，长度变化: %d", len(content) - before_len)
+        
+        self.logger.info(f"✅ 最终清理完成，长度: {len(content)} 字符")
+        self.logger.debug("✅ 清理后内容开头:\n%.500s...", content)
+        
+        return content
+
+    def _cleanup_chunk(self, content: str) -> str:
+        """单个块的清理，与 final_cleanup 对整篇文档的处理一致，用于逐块写出"""
+        if '[' in content:
+            content = self._strip_bracket_markers(content)
+        return normalize_layout(content)
+
+    def _strip_bracket_markers(self, content: str) -> str:
+        """移除AI添加的格式说明标记和异常长方括号块"""
+        # 方括号内容的列举只用于诊断，仅在DEBUG级别下扫描
+        if self.logger.isEnabledFor(logging.DEBUG):
+            brackets_content = BRACKET_RE.findall(content)
+            self.logger.debug("🔍 发现方括号内容: %d 个", len(brackets_content))
+            for i, bracket in enumerate(brackets_content[:5]):  # 显示前5个
+                self.logger.debug("  📋 方括号 %d: %.100s...", i + 1, bracket)
         
         # 移除AI添加的格式说明标记
-        total_removed = 0
-        for pattern in format_markers:
-            before_len = len(content)
-            content = re.sub(pattern, '', content)
-            after_len = len(content)
-            if before_len != after_len:
-                removed = before_len - after_len
-                total_removed += removed
-                self.logger.info(f"  ✂️  移除格式标记: {pattern[:30]}..., 减少 {removed} 字符")
+        before_len = len(content)
+        content, marker_count = _FORMAT_MARKERS_RE.subn('', content)
+        total_removed = before_len - len(content)
         
-        if total_removed > 0:
-            self.logger.info(f"🗑️  共移除格式标记: {total_removed} 字符")
+        if marker_count > 0:
+            self.logger.info(f"🗑️  共移除格式标记: {marker_count} 处, {total_removed} 字符")
         else:
             self.logger.info("✅ 未发现需要移除的格式标记")
         
         # 移除可能包含长文本的方括号块（这些通常是AI错误返回的格式）
         # 但要小心不要移除真正的内容
-        long_bracket_pattern = r'\[[^\]]{100,}\]'  # 超过100字符的方括号内容
-        long_brackets = re.findall(long_bracket_pattern, content)
+        long_brackets = _LONG_BRACKET_RE.findall(content)
         if long_brackets:
             self.logger.warning(f"⚠️  发现 {len(long_brackets)} 个长方括号块，可能是格式错误")
             for i, bracket in enumerate(long_brackets[:3]):
-                self.logger.debug(f"  📋 长方括号 {i+1} ({len(bracket)}字符): {bracket[:150]}...")
+                self.logger.debug("  📋 长方括号 %d (%d字符): %.150s...", i + 1, len(bracket), bracket)
             before_len = len(content)
-            content = re.sub(long_bracket_pattern, '', content)
+            content = _LONG_BRACKET_RE.sub('', content)
             after_len = len(content)
             self.logger.info(f"  ✂️  移除长方括号块，减少 {before_len - after_len} 字符")
         else:
             self.logger.info("✅ 未发现异常长方括号块")
         
-        self.logger.info(f"📊 移除格式标记后长度: {len(content)} 字符")
-        
-        # 确保标题格式正确
-        before_len = len(content)
-        content = re.sub(r'\n(#{1,6}\s)', r'\n\n\1', content)
-        if len(content) != before_len:
-            self.logger.debug(f"🔧 标题格式调整，长度变化: {len(content) - before_len}")
-        
-        # 清理多余的空行
-        before_len = len(content)
-        content = re.sub(r'\n{3,}', '\n\n', content)
-        if len(content) != before_len:
-            self.logger.debug(f"🔧 清理多余空行，减少 {before_len - len(content)} 字符")
-        
-        # 清理首尾空行
-        before_len = len(content)
-        content = content.strip()
-        if len(content) != before_len:
-            self.logger.debug(f"🔧 清理首尾空行，减少 {before_len - len(content)} 字符")
-        
-        self.logger.info(f"✅ 最终清理完成，长度: {len(content)} 字符")
-        self.logger.debug(f"✅ 清理后内容开头:\n{content[:500]}...")
-        
         return content
 
     # ==================== 边界优化相关方法 ====================
     
-    def get_boundary_optimization_prompt(self) -> str:
-        """获取边界优化的提示词"""
-        return """你是专业的文档编辑专家。以下文本来自视频字幕的分块翻译，由于分块边界问题产生了**内容重复**。
-
-==== 核心问题 ====
-分块处理时，一个句子可能被截断：
-- 前一块翻译了句子的一部分（可能不完整）
-- 后一块又从头翻译了同一句话
+    def _paragraph_spans(self, content: str) -> tuple:
+        """由段落分隔符的位置直接得到每个段落的起点列表和终点列表"""
+        starts = [0]
+        ends = []
+        for match in _PARAGRAPH_SEP_RE.finditer(content):
+            ends.append(match.start())
+            starts.append(match.end())
+        ends.append(len(content))
+        return starts, ends
 
-这导致**同一个意思被翻译了两次**，产生重复的中文段落。
-
-==== 典型重复模式 ====
-输入可能是这样的：
-```
-We talked about loss functions to quantify how happy or unhappy.
-我们讨论了用损失函数来量化满意或不满意程度。
-
-How happy or unhappy we are with different settings of the weights.
-我们对不同权重设置的满意或不满意程度。
-```
-这里"满意或不满意程度"的意思重复了。
-
-正确输出应该合并为：
-```
-We talked about loss functions to quantify how happy or unhappy we are with different settings of the weights.
-我们讨论了用损失函数来量化我们对不同权重设置的满意或不满意程度。
-```
-
-==== 你的任务 ====
-1. **识别语义重复**：找出表达相同或相似意思的段落
-2. **合并重复内容**：将重复的英文句子合并成完整句子，对应生成一个完整的中文翻译
-3. **删除冗余**：删除多余的翻译，保证每个意思只出现一次
-4. **保持格式**：英文段落 + 空行 + 中文翻译 + 空行
-
-==== 输入内容 ====
-{boundary_content}
-
-==== 输出要求 ====
-直接输出去重合并后的内容。格式：
-
-英文段落
-
-中文翻译
-
-（不要添加任何解释或标记）"""
-
-    def extract_boundary_context(self, content: str, split_position: int) -> tuple:
+    def _context_paragraphs(self, ends: List[int], split_position: int) -> tuple:
         """
-        根据分割位置提取边界上下文（提取分割点前后各2个段落）
+        确定分割点的上下文段落范围
         
-        Args:
-            content: 完整文档内容
-            split_position: 分割点在文档中的字符位置
-            
         Returns:
-            (边界上下文字符串, 实际开始位置, 实际结束位置)
+            (分割点所在段落索引, 起始段落索引, 结束段落索引（不含）)
         """
-        # 将内容按双换行分割成段落
-        parts = re.split(r'\n\n+', content)
-        
-        # 计算每个段落在原文中的位置
-        current_pos = 0
-        split_para_idx = -1
-        para_positions = []  # (start, end, content)
-        
-        for i, para in enumerate(parts):
-            para_start = content.find(para, current_pos)
-            if para_start == -1:
-                para_start = current_pos
-            para_end = para_start + len(para)
-            para_positions.append((para_start, para_end, para))
-            
-            # 找到分割点所在或之后的第一个段落
-            if split_para_idx == -1 and para_end >= split_position:
-                split_para_idx = i
-            
-            current_pos = para_end
-        
-        if split_para_idx == -1:
-            split_para_idx = len(para_positions) - 1
+        # 找到分割点所在或之后的第一个段落
+        split_para_idx = min(bisect.bisect_left(ends, split_position), len(ends) - 1)
         
         # 提取分割点前1个段落和后2个段落（共4个段落，确保完整的英中配对）
         # split_para_idx 通常是 chunk 末尾的中文段落，所以：
@@ -610,16 +1338,31 @@ We talked about loss functions to quantify how happy or unhappy we are with diff
         # - split_para_idx + 1: 英文段落（chunk2开头）
         # - split_para_idx + 2: 对应的中文段落
         start_idx = max(0, split_para_idx - 1)
-        end_idx = min(len(para_positions), split_para_idx + 3)
+        end_idx = min(len(ends), split_para_idx + 3)
+        return split_para_idx, start_idx, end_idx
+
+    def extract_boundary_context(self, content: str, split_position: int) -> tuple:
+        """
+        根据分割位置提取边界上下文（提取分割点前后各2个段落）
+        
+        Args:
+            content: 完整文档内容
+            split_position: 分割点在文档中的字符位置
+            
+        Returns:
+            (边界上下文字符串, 实际开始位置, 实际结束位置)
+        """
+        starts, ends = self._paragraph_spans(content)
+        split_para_idx, start_idx, end_idx = self._context_paragraphs(ends, split_position)
         
         # 计算实际的字符位置
-        start_pos = para_positions[start_idx][0]
-        end_pos = para_positions[end_idx - 1][1]
+        start_pos = starts[start_idx]
+        end_pos = ends[end_idx - 1]
         
         # 提取内容
         boundary_content = content[start_pos:end_pos]
         
-        self.logger.debug(f"📍 边界提取: 段落 {start_idx+1}-{end_idx}/{len(para_positions)}, 字符 {start_pos}-{end_pos}")
+        self.logger.debug("📍 边界提取: 段落 %d-%d/%d, 字符 %d-%d", start_idx + 1, end_idx, len(ends), start_pos, end_pos)
         
         return boundary_content, start_pos, end_pos
 
@@ -633,14 +1376,11 @@ We talked about loss functions to quantify how happy or unhappy we are with diff
             (边界索引, 修复后的内容, 是否成功)
         """
         self.logger.info(f"🔧 正在优化边界 {boundary_index + 1}...")
-        self.logger.debug(f"📥 边界 {boundary_index + 1} 输入内容:\n{'='*60}\n{boundary_content}\n{'='*60}")
+        self.logger.debug("📥 边界 %d 输入内容:\n%s", boundary_index + 1, boundary_content)
+        prompt = self._boundary_prefix + boundary_content + self._boundary_suffix
         
         for attempt in range(self.config['retry_attempts']):
             try:
-                prompt = self.get_boundary_optimization_prompt().format(
-                    boundary_content=boundary_content
-                )
-                
                 payload = {
                     "model": self.config['model'],
                     "messages": [
@@ -657,35 +1397,33 @@ We talked about loss functions to quantify how happy or unhappy we are with diff
                     "max_tokens": 2000
                 }
                 
-                headers = {
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                }
-                
-                timeout = aiohttp.ClientTimeout(total=self.config['request_timeout'])
-                
-                async with session.post(
-                    self.base_url,
-                    json=payload,
-                    headers=headers,
-                    timeout=timeout
-                ) as response:
+                await self.rate_limiter.acquire()
+                # 与块请求共用自适应并发名额，各边界并发发出时不会超出在途请求上限
+                async with self.limiter.slot() as sent_at:
+                    async with session.post(
+                        self.base_url,
+                        data=orjson.dumps(payload),
+                        headers=self._headers,
+                        timeout=self._timeout
+                    ) as response:
                     
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'choices' in result and result['choices']:
-                            fixed_content = result['choices'][0]['message']['content'].strip()
-                            self.logger.info(f"✅ 边界 {boundary_index + 1} 优化完成")
-                            self.logger.debug(f"📤 边界 {boundary_index + 1} AI返回内容:\n{'='*60}\n{fixed_content}\n{'='*60}")
-                            return (boundary_index, fixed_content, True)
+                        self.limiter.record(response.status, sent_at)
+                        self.rate_limiter.update_from_headers(response.headers)
+                        if response.status == 200:
+                            result = orjson.loads(await response.read())
+                            if 'choices' in result and result['choices']:
+                                fixed_content = result['choices'][0]['message']['content'].strip()
+                                self.logger.info(f"✅ 边界 {boundary_index + 1} 优化完成")
+                                self.logger.debug("📤 边界 %d AI返回内容:\n%s", boundary_index + 1, fixed_content)
+                                return (boundary_index, fixed_content, True)
+                            else:
+                                raise Exception("API响应格式错误")
                         else:
-                            raise Exception("API响应格式错误")
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"API错误 {response.status}: {error_text}")
+                            error_text = await response.text()
+                            raise APIError(response.status, error_text)
                         
             except Exception as e:
-                wait_time = self.config['retry_delay'] * (2 ** attempt)
+                wait_time = self._retry_wait(e, attempt)
                 self.logger.warning(f"边界 {boundary_index + 1} 优化失败 (第{attempt+1}次): {e}")
                 
                 if attempt < self.config['retry_attempts'] - 1:
@@ -694,35 +1432,60 @@ We talked about loss functions to quantify how happy or unhappy we are with diff
                     self.logger.error(f"边界 {boundary_index + 1} 优化彻底失败")
                     return (boundary_index, None, False)
 
-    def apply_boundary_fix(self, content: str, start_pos: int, end_pos: int,
-                           fixed_content: str) -> str:
-        """应用单个边界修复"""
-        if not fixed_content:
-            return content
-        
-        # 记录被替换的原始内容
-        original_segment = content[start_pos:end_pos]
-        self.logger.debug(f"🔄 边界修复 - 原始内容 (位置 {start_pos}-{end_pos}):\n{'='*60}\n{original_segment}\n{'='*60}")
-        self.logger.debug(f"🔄 边界修复 - 替换为:\n{'='*60}\n{fixed_content}\n{'='*60}")
+    def _boundary_windows(self, content: str, split_positions: List[int]) -> List[tuple]:
+        """
+        在修改文档之前一次性算出所有分割点的上下文窗口
         
-        # 清理修复内容
-        cleaned_fix = fixed_content.strip()
-        # 移除可能的标记（如果AI仍然返回了的话）
-        cleaned_fix = cleaned_fix.replace('---SPLIT_POINT---', '\n\n')
-        cleaned_fix = re.sub(r'\n{3,}', '\n\n', cleaned_fix)
-        cleaned_fix = cleaned_fix.strip()
+        分割点已落在前一个窗口内时并入该窗口一并修复；窗口只是首段与前一个窗口重叠时，
+        裁掉共用的段落。窗口大小不会因合并而增长，且各窗口互不相交。
         
-        # 替换原始内容
-        new_content = content[:start_pos] + cleaned_fix + content[end_pos:]
+        Returns:
+            按位置排序的 (开始位置, 结束位置, 分割点索引列表)
+        """
+        starts, ends = self._paragraph_spans(content)
+        windows = []
+        for original_idx, split_pos in sorted(enumerate(split_positions), key=lambda x: x[1]):
+            split_para_idx, start_idx, end_idx = self._context_paragraphs(ends, split_pos)
+            if windows and start_idx < windows[-1][1]:
+                if split_para_idx < windows[-1][1]:
+                    windows[-1][2].append(original_idx)
+                    continue
+                start_idx = windows[-1][1]
+            windows.append((start_idx, end_idx, [original_idx]))
+        return [(starts[start_idx], ends[end_idx - 1], indices) for start_idx, end_idx, indices in windows]
+
+    def apply_boundary_fixes(self, content: str, edits: List[tuple]) -> str:
+        """
+        一次性应用所有边界修复
         
-        return new_content
+        Args:
+            edits: 按位置排序、互不相交的 (开始位置, 结束位置, 修复后的内容)
+        """
+        parts = []
+        cursor = 0
+        for start_pos, end_pos, fixed_content in edits:
+            assert start_pos >= cursor, "边界修复区间重叠"
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("🔄 边界修复 - 原始内容 (位置 %d-%d):\n%s", start_pos, end_pos, content[start_pos:end_pos])
+                self.logger.debug("🔄 边界修复 - 替换为:\n%s", fixed_content)
+            
+            # 清理修复内容，移除可能的标记（如果AI仍然返回了的话）
+            cleaned_fix = fixed_content.strip().replace('---SPLIT_POINT---', '\n\n')
+            cleaned_fix = BLANKLINES_RE.sub('\n\n', cleaned_fix).strip()
+            
+            parts.append(content[cursor:start_pos])
+            parts.append(cleaned_fix)
+            cursor = end_pos
+        parts.append(content[cursor:])
+        return ''.join(parts)
 
-    async def optimize_boundaries_async(self, content: str, 
+    async def optimize_boundaries_async(self, session: Optional[aiohttp.ClientSession], content: str,
                                          split_positions: List[int]) -> str:
         """
         异步优化所有边界
         
         Args:
+            session: API会话，为空时使用共享会话
             content: 文档内容
             split_positions: 分割点位置列表
             
@@ -733,43 +1496,73 @@ We talked about loss functions to quantify how happy or unhappy we are with diff
             self.logger.info("✅ 没有需要优化的边界")
             return content
         
+        if session is None:
+            session = await self._get_session()
+        
         self.logger.info(f"🔧 开始边界优化: {len(split_positions)} 个分割点")
         
-        # 顺序处理每个边界，并实时更新位置
-        connector = aiohttp.TCPConnector(limit=1, limit_per_host=1)
+        # 先在原文上算好所有窗口，修复结果收集后一次拼接，避免每处边界都复制整篇文档
+        windows = self._boundary_windows(content, split_positions)
+        if len(windows) < len(split_positions):
+            self.logger.info(f"🔗 {len(split_positions) - len(windows)} 个分割点落在相邻边界的窗口内，合并后共 {len(windows)} 个窗口")
+        
+        # 各窗口互不相交，全部并发请求，并发数由自适应限流器控制
+        results = await asyncio.gather(*(
+            self.optimize_single_boundary_async(session, content[start_pos:end_pos], indices[0])
+            for start_pos, end_pos, indices in windows
+        ))
+        
+        edits = [
+            (start_pos, end_pos, fixed_content)
+            for (start_pos, end_pos, _), (_, fixed_content, success) in zip(windows, results)
+            if success and fixed_content
+        ]
         
-        # 从后向前处理，这样前面的位置不会受影响
-        sorted_positions = sorted(enumerate(split_positions), key=lambda x: x[1], reverse=True)
+        # 应用修复
+        content = self.apply_boundary_fixes(content, edits)
         
-        async with aiohttp.ClientSession(connector=connector) as session:
-            for original_idx, split_pos in sorted_positions:
-                # 提取当前边界上下文
-                boundary_content, start_pos, end_pos = self.extract_boundary_context(
-                    content, split_pos
-                )
-                
-                # 优化边界
-                idx, fixed_content, success = await self.optimize_single_boundary_async(
-                    session, boundary_content, original_idx
-                )
-                
-                # 应用修复
-                if success and fixed_content:
-                    content = self.apply_boundary_fix(
-                        content, start_pos, end_pos, fixed_content
-                    )
-                    self.logger.debug(f"应用边界 {original_idx + 1} 修复")
-        
-        self.logger.info(f"🎉 边界优化完成! 成功优化 {len(split_positions)} 处边界")
+        self.logger.info(f"🎉 边界优化完成! 成功优化 {len(edits)}/{len(windows)} 处边界")
         
         return content
 
     def process_file(self, input_file: str, output_file: str = None):
         """同步接口"""
-        return asyncio.run(self.process_file_async(input_file, output_file))
+        return asyncio.run(self._closing_session(self.process_file_async(input_file, output_file)))
+
+    async def _closing_session(self, coro):
+        """运行协程，结束后关闭共享会话"""
+        try:
+            return await coro
+        finally:
+            await close_session()
 
     def batch_process_folder(self, input_folder: str, output_folder: str = None, file_pattern: str = "*.txt"):
-        """批量处理文件夹中的所有文件"""
+        """批量处理文件夹中的所有文件（同步接口）"""
+        return asyncio.run(self._with_thread_pool(
+            self.batch_process_folder_async(input_folder, output_folder, file_pattern)
+        ))
+
+    async def _with_thread_pool(self, coro):
+        """
+        在限定大小的默认线程池中运行协程
+        
+        每个在处理的文件占用一个线程边读边分块，另外至少留出两个线程给写文件等短任务，
+        文件并发数调大时不会因线程池耗尽而排队
+        """
+        workers = max(self.config['max_workers'], self.config['file_concurrency'] + 2)
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix='converter')
+        )
+        return await coro
+
+    async def batch_process_folder_async(self, input_folder: str, output_folder: str = None,
+                                         file_pattern: str = "*.txt"):
+        """
+        批量处理文件夹中的所有文件
+        
+        所有文件共用一个事件循环和共享API会话（处理结束后关闭），由文件信号量限制同时处理的文件数；
+        各文件的块请求仍共同受全局并发数与速率限制约束
+        """
         input_path = Path(input_folder)
         if not input_path.exists():
             raise FileNotFoundError(f"找不到文件夹: {input_folder}")
@@ -783,51 +1576,36 @@ We talked about loss functions to quantify how happy or unhappy we are with diff
         output_path = Path(output_folder)
         output_path.mkdir(exist_ok=True)
         
-        # 查找所有匹配的文件
-        pattern_path = input_path / file_pattern
-        files = list(input_path.glob(file_pattern))
-        
-        if not files:
-            self.logger.warning(f"在文件夹 {input_folder} 中未找到匹配 {file_pattern} 的文件")
-            return []
+        total_start_time = time.time()
         
-        self.logger.info(f"📁 找到 {len(files)} 个待处理文件")
+        self._ensure_flow_control()
+        file_semaphore = asyncio.Semaphore(self.config['file_concurrency'])
         
-        processed_files = []
-        total_start_time = time.time()
+        async def run_file(index: int, input_file: Path) -> FileResult:
+            async with file_semaphore:
+                return await self._process_one(session, input_file, output_path, index)
         
-        for i, input_file in enumerate(files, 1):
-            try:
-                self.logger.info(f"\n{'='*50}")
-                self.logger.info(f"📄 处理文件 {i}/{len(files)}: {input_file.name}")
-                self.logger.info(f"{'='*50}")
-                
-                # 生成输出文件名（保留原始文件名，标题提取由 formatter 处理）
-                output_file = output_path / f"{input_file.stem}.md"
-                
-                # 处理文件
-                result_file = self.process_file(str(input_file), str(output_file))
-                processed_files.append({
-                    'input': str(input_file),
-                    'output': result_file,
-                    'status': 'success'
-                })
-                
-                self.logger.info(f"✅ 完成: {input_file.name} -> {Path(result_file).name}")
-                
-            except Exception as e:
-                self.logger.error(f"❌ 处理失败 {input_file.name}: {e}")
-                processed_files.append({
-                    'input': str(input_file),
-                    'output': None,
-                    'status': 'failed',
-                    'error': str(e)
-                })
+        session = await self._get_session()
+        try:
+            # 边扫描文件夹边调度，找到的文件立即开始处理
+            tasks = []
+            file_iter = _iter_files(input_path, file_pattern)
+            while (input_file := await asyncio.to_thread(next, file_iter, None)) is not None:
+                tasks.append(asyncio.create_task(run_file(len(tasks) + 1, input_file)))
+            
+            if not tasks:
+                self.logger.warning(f"在文件夹 {input_folder} 中未找到匹配 {file_pattern} 的文件")
+                return []
+            
+            self.logger.info(f"📁 找到 {len(tasks)} 个待处理文件")
+            processed_files = list(await asyncio.gather(*tasks))
+        finally:
+            await close_session()
         
         total_elapsed = time.time() - total_start_time
         
         # 统计结果
-        success_count = sum(1 for f in processed_files if f['status'] == 'success')
+        success_count = sum(1 for f in processed_files if f.status == 'success')
         failed_count = len(processed_files) - success_count
         
         self.logger.info(f"\n🎉 批量处理完成!")
@@ -839,6 +1617,26 @@ We talked about loss functions to quantify how happy or unhappy we are with diff
         
         return processed_files
 
+    async def _process_one(self, session: aiohttp.ClientSession, input_file: Path,
+                           output_path: Path, index: int) -> FileResult:
+        """批量模式下处理单个文件，返回结果记录"""
+        try:
+            self.logger.info(f"\n{'='*50}")
+            self.logger.info(f"📄 处理文件 {index}: {input_file.name}")
+            self.logger.info(f"{'='*50}")
+            
+            # 生成输出文件名（保留原始文件名，标题提取由 formatter 处理）
+            output_file = output_path / f"{input_file.stem}.md"
+            
+            # 处理文件
+            result_file = await self.process_file_async(str(input_file), str(output_file), session)
+            self.logger.info(f"✅ 完成: {input_file.name} -> {Path(result_file).name}")
+            return FileResult(input=str(input_file), output=result_file, status='success')
+            
+        except Exception as e:
+            self.logger.error(f"❌ 处理失败 {input_file.name}: {e}")
+            return FileResult(input=str(input_file), output=None, status='failed', error=str(e))
+
     # def clean_filename(self, filename: str) -> str:
     #     """清理文件名，生成更简洁的输出文件名"""
     #     clean = re.sub(r'[\[\](){}]', '', filename)
@@ -852,13 +1650,26 @@ We talked about loss functions to quantify how happy or unhappy we are with diff
         
     #     return clean or "processed_file"
 
-def main():
-    parser = argparse.ArgumentParser(description='优化字幕转换器 - 顺序处理、智能分块、段落级翻译')
+def main(argv: Optional[List[str]] = None):
+    """命令行入口，也可由 main.py 在同一进程中直接调用"""
+    parser = argparse.ArgumentParser(description='优化字幕转换器 - 并发处理、智能分块、段落级翻译')
     parser.add_argument('--input_path', help='输入字幕文件路径或文件夹路径', default='../raw')
     parser.add_argument('-o', '--output', help='输出文件路径或文件夹路径', default="../output")
     parser.add_argument('-k', '--api-key', help='DeepSeek API密钥')
-    parser.add_argument('--chunk-size', type=int, help='每块包含的单词数', default=1200)
+    parser.add_argument('--chunk-size', type=int,
+                        help='每块包含的单词数；单独给出时按单词数分块 (默认: 1200，未安装 tiktoken 时使用)')
+    parser.add_argument('--chunk-tokens', type=int,
+                        help='每块包含的输入token数，0表示按单词数分块 (默认: 1500，需安装 tiktoken)')
     parser.add_argument('--temperature', type=float, default=0.1, help='AI温度参数')
+    parser.add_argument('--concurrency', type=int, default=8, help='同时在途的API请求数初始值，之后自适应调整 (默认: 8)')
+    parser.add_argument('--max-concurrency', type=int, default=32, help='自适应并发的上限 (默认: 32)')
+    parser.add_argument('--file-concurrency', type=int, default=4, help='批量模式下同时处理的文件数 (默认: 4)')
+    parser.add_argument('--max-workers', type=int, default=8, help='读写文件使用的线程数 (默认: 8)')
+    parser.add_argument('--rps', type=float, default=5, help='每秒最多发出的API请求数，0表示不限 (默认: 5)')
+    parser.add_argument('--no-cache', action='store_true', help='禁用本地API响应缓存')
+    parser.add_argument('-v', '--verbose', action='store_true', help='日志文件中记录DEBUG级别的详细内容')
+    parser.add_argument('--semantic-cache', action='store_true',
+                        help='启用语义缓存，复用近似重复块的响应（需安装 sentence-transformers 和 faiss-cpu）')
     parser.add_argument('--batch', action='store_true', help='批量处理模式，处理文件夹中的所有文件')
     parser.add_argument('--pattern', default='*.txt', help='批量模式下的文件匹配模式 (默认: *.txt)')
     parser.add_argument('--enable-boundary-optimization', action='store_true', default=True,
@@ -866,7 +1677,7 @@ def main():
     parser.add_argument('--disable-boundary-optimization', action='store_true',
                         help='禁用边界优化')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     # 获取API密钥
     api_key = args.api_key or os.getenv('DEEPSEEK_API_KEY')
@@ -878,11 +1689,24 @@ def main():
     
     # 配置
     config = {
-        "chunk_size": args.chunk_size,
         "temperature": args.temperature,
+        "concurrency": args.concurrency,
+        "max_concurrency": args.max_concurrency,
+        "file_concurrency": args.file_concurrency,
+        "max_workers": args.max_workers,
+        "requests_per_second": args.rps,
+        "enable_cache": not args.no_cache,
+        "semantic_cache": args.semantic_cache,
+        "verbose": args.verbose,
         "enable_boundary_optimization": args.enable_boundary_optimization and not args.disable_boundary_optimization
     }
+    # 只传入命令行显式给出的分块上限，其余沿用默认配置（单独给出 --chunk-size 时按单词数分块）
+    if args.chunk_size is not None:
+        config["chunk_size"] = args.chunk_size
+    if args.chunk_tokens is not None:
+        config["chunk_tokens"] = args.chunk_tokens
     
+    converter = None
     try:
         converter = OptimizedSubtitleConverter(api_key, config)
         
@@ -896,16 +1720,20 @@ def main():
         
         results = converter.batch_process_folder(
             str(input_path), 
-            args.output
+            args.output,
+            args.pattern
         )
         
-        success_count = sum(1 for r in results if r['status'] == 'success')
+        success_count = sum(1 for r in results if r.status == 'success')
         print(f"\n🎉 批量处理完成!")
         print(f"📊 成功处理 {success_count}/{len(results)} 个文件")
         
     except Exception as e:
         print(f"❌ 处理失败: {e}")
         logging.error(f"处理失败: {e}", exc_info=True)
+    finally:
+        if converter is not None:
+            converter.close()
 
 
 if __name__ == "__main__":
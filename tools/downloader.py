@@ -4,10 +4,16 @@ YouTube 字幕下载器
 """
 
 import os
+import re
 import sys
+import json
 import argparse
+import asyncio
+import threading
+from functools import lru_cache
+from itertools import chain, islice
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Iterable, Iterator
 import logging
 
 # Windows 控制台输出优化（仅用于 print，不修改 sys.stdout）
@@ -32,6 +38,47 @@ except ImportError:
     print("建议运行: pip install yt-dlp")
     yt_dlp = None
 
+# 文件名清理：Windows 文件名非法字符 < > : " / \ | ? * 与控制字符
+_ILLEGAL_CHARS_RE = re.compile(r'[<>:"/\\|?*]')
+_CONTROL_CHARS_RE = re.compile(r'[\x00-\x1f\x7f]')
+
+# 支持多种 YouTube URL 格式
+_VIDEO_URL_RES = [
+    re.compile(r'(?:youtube\.com\/watch\?v=|youtu\.be\/)([^&\n?#]+)'),
+    re.compile(r'youtube\.com\/embed\/([^&\n?#]+)'),
+    re.compile(r'youtube\.com\/v\/([^&\n?#]+)'),
+]
+_VIDEO_ID_RE = re.compile(r'^[a-zA-Z0-9_-]{11}$')
+
+# YouTube 上同一语言可能以不同代码提供字幕，按优先级排列；未列出的语言只匹配其本身
+LANG_VARIANTS = {
+    'zh-CN': ['zh-Hans', 'zh-CN', 'zh'],
+    'zh-TW': ['zh-Hant', 'zh-TW'],
+}
+
+# 字幕文件逐行清理：时间戳行 (00:00:00.000 --> 00:00:00.000)、SRT 序号行、VTT 标签 (如 <c>, </c>, <00:00:00.000> 等)
+_TIMESTAMP_RE = re.compile(r'\d{2}:\d{2}:\d{2}[.,]\d{3}\s*-->\s*\d{2}:\d{2}:\d{2}[.,]\d{3}')
+_SRT_INDEX_RE = re.compile(r'\d+\n')
+_TAG_RE = re.compile(r'<[^>]+>')
+
+# yt-dlp 可能下载到的字幕格式；json3 由 _iter_json3_lines 处理，其余由 _iter_subtitle_lines 处理
+SUBTITLE_EXTS = ('.json3', '.vtt', '.srt')
+
+
+@lru_cache(maxsize=4096)
+def extract_video_id(url: str) -> Optional[str]:
+    """从 YouTube URL 或视频 ID 中提取视频 ID，提取失败返回 None；同一字符串只解析一次"""
+    # 直接给出视频 ID 时不必尝试各种 URL 格式
+    if len(url) == 11 and _VIDEO_ID_RE.match(url):
+        return url
+    
+    for pattern in _VIDEO_URL_RES:
+        match = pattern.search(url)
+        if match:
+            return match.group(1)
+    
+    return None
+
 
 class YouTubeSubtitleDownloader:
     """YouTube 字幕下载器类"""
@@ -62,6 +109,69 @@ class YouTubeSubtitleDownloader:
         # 确保输出目录存在
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.logger.info(f"输出目录: {self.output_dir}")
+        
+        # 视频信息缓存 - 跨运行保存在输出目录中，重复处理同一视频且字幕文本已存在时不再请求 YouTube；
+        # 本次运行新增的条目在 close() 时一次写回。字幕列表可能随时更新，只在本次运行内缓存
+        self._info_cache_path = self.output_dir / '.yt_info_cache.json'
+        self._info_cache = self._load_info_cache()
+        self._info_cache_dirty = False
+        self._info_cache_lock = threading.Lock()
+        self._transcripts_cache = {}
+        
+        # 多个视频之间复用同一个字幕API对象和 YoutubeDL 实例，保持 HTTP 连接与 cookies；
+        # YoutubeDL 不是线程安全的，并发下载时每个线程各用一个
+        self._api = YouTubeTranscriptApi()
+        self._ydls = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def close(self):
+        """关闭复用的 YoutubeDL 实例（保存 cookies、释放连接），写回视频信息缓存"""
+        for ydl in self._ydls.values():
+            ydl.close()
+        self._ydls.clear()
+        self._save_info_cache()
+    
+    def _get_ydl(self, key, ydl_opts: dict):
+        """按用途取得当前线程复用的 YoutubeDL 实例，首次使用时按 ydl_opts 创建"""
+        key = (threading.get_ident(), key)
+        ydl = self._ydls.get(key)
+        if ydl is None:
+            ydl = self._ydls[key] = yt_dlp.YoutubeDL(ydl_opts)
+        return ydl
+    
+    def _load_info_cache(self) -> dict:
+        """读取视频信息缓存，文件不存在或损坏时返回空缓存"""
+        try:
+            with open(self._info_cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _cache_video_info(self, video_id: str, info: dict) -> dict:
+        """记录视频信息，由 close() 统一写回缓存文件"""
+        with self._info_cache_lock:
+            self._info_cache[video_id] = info
+            self._info_cache_dirty = True
+        return dict(info)
+    
+    def _save_info_cache(self) -> None:
+        """有新增条目时原子地写回缓存文件（先写临时文件再替换）"""
+        with self._info_cache_lock:
+            if not self._info_cache_dirty:
+                return
+            tmp_path = self._info_cache_path.with_suffix('.tmp')
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._info_cache, f, ensure_ascii=False)
+                os.replace(tmp_path, self._info_cache_path)
+                self._info_cache_dirty = False
+            except OSError as e:
+                self.logger.warning(f"写入视频信息缓存失败: {e}")
     
     def _sanitize_filename(self, filename: str) -> str:
         """
@@ -73,14 +183,11 @@ class YouTubeSubtitleDownloader:
         Returns:
             清理后的文件名
         """
-        import re
-        
         # 移除 Windows 文件名非法字符: < > : " / \ | ? *
-        illegal_chars = r'[<>:"/\\|?*]'
-        cleaned = re.sub(illegal_chars, '_', filename)
+        cleaned = _ILLEGAL_CHARS_RE.sub('_', filename)
         
         # 移除控制字符和多余空格
-        cleaned = re.sub(r'[\x00-\x1f\x7f]', '', cleaned)
+        cleaned = _CONTROL_CHARS_RE.sub('', cleaned)
         cleaned = ' '.join(cleaned.split())
         
         # 限制文件名长度（保留足够空间给语言后缀）
@@ -100,25 +207,7 @@ class YouTubeSubtitleDownloader:
         Returns:
             视频 ID，如果提取失败则返回 None
         """
-        import re
-        
-        # 支持多种 YouTube URL 格式
-        patterns = [
-            r'(?:youtube\.com\/watch\?v=|youtu\.be\/)([^&\n?#]+)',
-            r'youtube\.com\/embed\/([^&\n?#]+)',
-            r'youtube\.com\/v\/([^&\n?#]+)'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-        
-        # 如果不是 URL，可能直接是视频 ID
-        if re.match(r'^[a-zA-Z0-9_-]{11}$', url):
-            return url
-        
-        return None
+        return extract_video_id(url)
     
     def get_video_info(self, video_id: str) -> dict:
         """
@@ -130,6 +219,9 @@ class YouTubeSubtitleDownloader:
         Returns:
             视频信息字典
         """
+        if video_id in self._info_cache:
+            return dict(self._info_cache[video_id])
+        
         if not yt_dlp:
             return {"title": video_id}
         
@@ -140,13 +232,13 @@ class YouTubeSubtitleDownloader:
                 'extract_flat': True
             }
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
-                return {
-                    "title": info.get('title', video_id),
-                    "duration": info.get('duration', 0),
-                    "uploader": info.get('uploader', 'Unknown')
-                }
+            ydl = self._get_ydl('info', ydl_opts)
+            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False)
+            return self._cache_video_info(video_id, {
+                "title": info.get('title', video_id),
+                "duration": info.get('duration', 0),
+                "uploader": info.get('uploader', 'Unknown')
+            })
         except Exception as e:
             self.logger.warning(f"获取视频信息失败: {e}")
             return {"title": video_id}
@@ -161,9 +253,11 @@ class YouTubeSubtitleDownloader:
         Returns:
             可用字幕列表
         """
+        if video_id in self._transcripts_cache:
+            return list(self._transcripts_cache[video_id])
+        
         try:
-            api = YouTubeTranscriptApi()
-            transcript_list = api.list(video_id)
+            transcript_list = self._api.list(video_id)
             
             available = []
             for transcript in transcript_list:
@@ -174,7 +268,8 @@ class YouTubeSubtitleDownloader:
                     'is_translatable': len(transcript.translation_languages) > 0
                 })
             
-            return available
+            self._transcripts_cache[video_id] = available
+            return list(available)
         except Exception as e:
             self.logger.error(f"获取字幕列表失败: {e}")
             return []
@@ -195,13 +290,22 @@ class YouTubeSubtitleDownloader:
             self.logger.error(f"无法从 URL 提取视频 ID: {url}")
             return []
         
+        # 之前处理过该视频且所有语言的字幕文本仍在时，由缓存的标题得到文件名，不再请求 YouTube
+        cached_info = self._info_cache.get(video_id)
+        if cached_info:
+            safe_title = self._sanitize_filename(cached_info['title'])
+            existing = [self.output_dir / f"{safe_title}_{lang}.txt" for lang in languages]
+            if all(path.exists() for path in existing):
+                self.logger.info(f"✓ 视频 {video_id} 的字幕已存在，跳过下载")
+                return [str(path) for path in existing]
+        
         downloaded_files = []
         
         try:
             self.logger.info(f"正在下载视频 {video_id} 的字幕...")
             
-            # 构建语言参数
-            lang_str = ','.join(languages)
+            # 构建语言参数：每种语言连同其变体代码一起请求
+            lang_variants = {lang: LANG_VARIANTS.get(lang, [lang]) for lang in languages}
             
             # 只使用 cookies.txt 文件（从浏览器获取 cookies 在 Windows 上有 DPAPI 问题）
             cookies_path = Path(__file__).parent / 'cookies.txt'
@@ -211,9 +315,10 @@ class YouTubeSubtitleDownloader:
                 'skip_download': True,  # 不下载视频
                 'writesubtitles': True,  # 下载字幕
                 'writeautomaticsub': True,  # 也下载自动生成的字幕
-                'subtitleslangs': languages,  # 字幕语言
-                'subtitlesformat': 'vtt/srt/best',  # 字幕格式
-                'outtmpl': str(self.output_dir / '%(title)s.%(ext)s'),
+                'subtitleslangs': [code for codes in lang_variants.values() for code in codes],  # 字幕语言
+                'subtitlesformat': 'json3/vtt/srt/best',  # 字幕格式：优先 json3，文本已按片段给出，无需正则清理
+                # 以视频ID命名，并发下载多个视频时各自的字幕文件不会混淆
+                'outtmpl': str(self.output_dir / '%(id)s.%(ext)s'),
                 'quiet': False,
                 'no_warnings': False,
                 'verbose': True
@@ -227,37 +332,54 @@ class YouTubeSubtitleDownloader:
             
             video_url = f"https://www.youtube.com/watch?v={video_id}"
             
-            # 记录下载前的文件列表
-            existing_files = set(self.output_dir.glob('*.*'))
+            ydl = self._get_ydl(('download', tuple(languages)), ydl_opts)
+            info = ydl.extract_info(video_url, download=True)
+            video_title = info.get('title', video_id)
+            safe_title = self._sanitize_filename(video_title)
+            if video_id not in self._info_cache:
+                self._cache_video_info(video_id, {
+                    "title": video_title,
+                    "duration": info.get('duration', 0),
+                    "uploader": info.get('uploader', 'Unknown')
+                })
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(video_url, download=True)
-                video_title = info.get('title', video_id)
-                safe_title = self._sanitize_filename(video_title)
+            # 本视频下载的字幕文件名为 {视频ID}.{语言代码}.{扩展名}，一次扫描按语言代码归类
+            # 只比较文件名字符串，命中的文件才构造 Path
+            prefix = f'{video_id}.'
+            subtitle_files = {}
+            with os.scandir(self.output_dir) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name.startswith(prefix) and name.endswith(SUBTITLE_EXTS) and entry.is_file():
+                        subtitle_files[name[len(prefix):name.rindex('.')]] = Path(entry.path)
+            
+            for lang in languages:
+                # 取优先级最高的可用变体
+                subtitle_file = next(
+                    (subtitle_files[code] for code in lang_variants[lang] if code in subtitle_files), None
+                )
+                if subtitle_file is None:
+                    continue
+                
+                # 保存为 TXT 文件
+                txt_filename = f"{safe_title}_{lang}.txt"
+                txt_path = self.output_dir / txt_filename
                 
-                # 查找新下载的字幕文件
-                new_files = set(self.output_dir.glob('*.*')) - existing_files
+                # json3 直接取出文本片段；没有 json3 时逐行读取 VTT/SRT 并清理，内存中不出现整篇文本
+                with open(subtitle_file, 'r', encoding='utf-8') as src, \
+                        open(txt_path, 'w', encoding='utf-8') as dst:
+                    if subtitle_file.suffix == '.json3':
+                        text_lines = self._iter_json3_lines(json.load(src))
+                    else:
+                        text_lines = self._iter_subtitle_lines(src)
+                    dst.writelines(chain(islice(text_lines, 1), ('\n' + line for line in text_lines)))
                 
-                for lang in languages:
-                    # 查找匹配语言的字幕文件
-                    for new_file in new_files:
-                        if f'.{lang}.' in new_file.name and new_file.suffix in ['.vtt', '.srt']:
-                            # 读取字幕并转换为纯文本
-                            txt_content = self._extract_text_from_subtitle(new_file)
-                            
-                            # 保存为 TXT 文件
-                            txt_filename = f"{safe_title}_{lang}.txt"
-                            txt_path = self.output_dir / txt_filename
-                            
-                            with open(txt_path, 'w', encoding='utf-8') as f:
-                                f.write(txt_content)
-                            
-                            self.logger.info(f"✓ 下载成功: {txt_filename}")
-                            downloaded_files.append(str(txt_path))
-                            
-                            # 删除原始字幕文件
-                            new_file.unlink()
-                            break
+                self.logger.info(f"✓ 下载成功: {txt_filename}")
+                downloaded_files.append(str(txt_path))
+            
+            # 删除原始字幕文件（包括未用到的变体）
+            for subtitle_file in subtitle_files.values():
+                subtitle_file.unlink(missing_ok=True)
             
             if not downloaded_files:
                 self.logger.error("未能下载任何字幕文件。可能的原因：")
@@ -272,46 +394,68 @@ class YouTubeSubtitleDownloader:
         
         return downloaded_files
     
-    def _extract_text_from_subtitle(self, subtitle_path: Path) -> str:
+    async def download_subtitles_async(self, urls: List[str], languages: List[str],
+                                       concurrency: int = 4, show_info: bool = True) -> List[str]:
         """
-        从 VTT/SRT 字幕文件中提取纯文本
+        在一个事件循环中并发下载多个视频的字幕
         
         Args:
-            subtitle_path: 字幕文件路径
+            urls: YouTube 视频 URL 或视频 ID 列表
+            languages: 语言列表
+            concurrency: 同时下载的视频数上限
+            show_info: 下载前是否查询并打印可用字幕列表
             
         Returns:
-            纯文本内容
+            按 urls 顺序汇总的字幕文件路径列表
         """
-        import re
-        
-        with open(subtitle_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # 移除 VTT 头部
-        content = re.sub(r'^WEBVTT\n.*?\n\n', '', content, flags=re.DOTALL)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
         
-        # 移除时间戳行 (00:00:00.000 --> 00:00:00.000)
-        content = re.sub(r'\d{2}:\d{2}:\d{2}[.,]\d{3}\s*-->\s*\d{2}:\d{2}:\d{2}[.,]\d{3}.*?\n', '', content)
+        async def fetch_one(url: str) -> List[str]:
+            # yt-dlp 与字幕API只提供同步接口，放到线程中执行，由信号量限制同时在途的视频数
+            async with semaphore:
+                if show_info:
+                    print(await asyncio.to_thread(self.get_available_transcripts, self.extract_video_id(url)))
+                return await asyncio.to_thread(self.download_subtitle, url, languages)
         
-        # 移除 SRT 序号行
-        content = re.sub(r'^\d+\n', '', content, flags=re.MULTILINE)
-        
-        # 移除 VTT 标签 (如 <c>, </c>, <00:00:00.000> 等)
-        content = re.sub(r'<[^>]+>', '', content)
-        
-        # 移除空行并合并
-        lines = [line.strip() for line in content.split('\n') if line.strip()]
+        results = await asyncio.gather(*(fetch_one(url) for url in urls))
+        return [file for files in results for file in files]
+    
+    def _iter_json3_lines(self, data: dict) -> Iterator[str]:
+        """从 json3 字幕的 events[*].segs[*].utf8 中取出文本行，产出非空且不与上一行重复的行"""
+        prev = None
+        for event in data.get('events', ()):
+            segs = event.get('segs')
+            if not segs:
+                continue
+            for line in ''.join(seg.get('utf8', '') for seg in segs).split('\n'):
+                line = line.strip()
+                if line and line != prev:
+                    yield line
+                    prev = line
+    
+    def _iter_subtitle_lines(self, lines: Iterable[str]) -> Iterator[str]:
+        """逐行移除 VTT 头部、时间戳行、SRT 序号行和 VTT 标签，产出非空且不与上一行重复的文本行"""
+        lines = iter(lines)
+        first = next(lines, '')
+        if first.startswith('WEBVTT'):
+            # VTT 头部到第一个空行为止
+            for line in lines:
+                if not line.strip():
+                    break
+        else:
+            lines = chain([first], lines)
         
-        # 去除重复的连续行
-        unique_lines = []
+        prev = None
         for line in lines:
-            if not unique_lines or line != unique_lines[-1]:
-                unique_lines.append(line)
-        
-        return '\n'.join(unique_lines)
+            if _SRT_INDEX_RE.fullmatch(line) or _TIMESTAMP_RE.search(line):
+                continue
+            line = _TAG_RE.sub('', line).strip()
+            if line and line != prev:
+                yield line
+                prev = line
     
-def main():
-    """命令行入口"""
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口，也可由 main.py 在同一进程中直接调用；返回退出码"""
     parser = argparse.ArgumentParser(
         description='YouTube 字幕下载器',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -320,6 +464,9 @@ def main():
   # 下载英文字幕
   python downloader.py "https://www.youtube.com/watch?v=VIDEO_ID"
   
+  # 一次下载多个视频（也可用 --url-file 从文件读取，每行一个）
+  python downloader.py VIDEO_ID_1 VIDEO_ID_2 --workers 4
+  
   # 下载指定语言字幕
   python downloader.py "https://www.youtube.com/watch?v=VIDEO_ID" --languages en zh-CN
   
@@ -332,8 +479,27 @@ def main():
     )
     
     parser.add_argument(
-        'url',
-        help='YouTube 视频 URL 或视频 ID'
+        'urls',
+        nargs='*',
+        help='YouTube 视频 URL 或视频 ID，可以一次给出多个'
+    )
+    
+    parser.add_argument(
+        '--url-file', '-f',
+        help='包含视频 URL 的文本文件，每行一个'
+    )
+    
+    parser.add_argument(
+        '--no-info',
+        action='store_true',
+        help='不查询并打印可用字幕列表，省去一次额外的网络请求'
+    )
+    
+    parser.add_argument(
+        '--workers', '-w',
+        type=int,
+        default=4,
+        help='同时下载的视频数 (默认: 4)'
     )
     
     parser.add_argument(
@@ -354,18 +520,24 @@ def main():
         help='优先下载自动生成的字幕（默认优先手动上传的字幕）'
     )
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
-    # 创建下载器
-    downloader = YouTubeSubtitleDownloader(output_dir=args.output)
+    urls = list(args.urls)
+    if args.url_file:
+        with open(args.url_file, 'r', encoding='utf-8') as f:
+            urls.extend(line.strip() for line in f if line.strip())
+    if not urls:
+        parser.error('请提供至少一个视频 URL 或 --url-file')
     
-    print(downloader.get_available_transcripts(downloader.extract_video_id(args.url)))
-
-    # 下载字幕
-    downloaded = downloader.download_subtitle(
-        args.url,
-        languages=args.languages
-    )
+    # 创建下载器
+    with YouTubeSubtitleDownloader(output_dir=args.output) as downloader:
+        # 多个视频并发下载，网络等待相互重叠
+        downloaded = asyncio.run(downloader.download_subtitles_async(
+            urls,
+            languages=args.languages,
+            concurrency=args.workers,
+            show_info=not args.no_info
+        ))
     
     if downloaded:
         print(f"\n成功下载 {len(downloaded)} 个字幕文件:")
@@ -373,8 +545,9 @@ def main():
             print(f"  - {file}")
     else:
         print("\n未能下载任何字幕文件")
-        sys.exit(1)
+        return 1
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
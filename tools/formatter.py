@@ -1,37 +1,247 @@
 import os
 import shutil
 import re
-import yaml
+import sys
+import argparse
+import pickle
+import hashlib
+import tempfile
+import mmap
+import json
+import threading
+import contextlib
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from typing import Iterator, List, Optional
+
+# 配置使用 TOML，Python 3.11+ 自带 tomllib，更早的版本使用同接口的 tomli
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
 
 # Base paths
 base_path = "../"
 processed_path = os.path.join(base_path, "output")
 
-# Load config
-config_path = os.path.join(base_path, "config.yml")
-with open(config_path, 'r', encoding='utf-8') as f:
-    config = yaml.safe_load(f)
-output_path = config['output_path']
+# 解析结果缓存目录：以配置文件的 (st_mtime_ns, st_size, st_ino) 为键，文件未改动时直接读取 pickle，跳过解析
+CONFIG_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ytva")
+
+
+def _parse_config(path: str) -> dict:
+    """解析配置文件：config.toml 使用 tomllib；旧的 config.yml 仍可读取，此时才需要 PyYAML"""
+    if path.endswith('.toml'):
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    
+    import yaml
+    try:
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader
+    with open(path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=SafeLoader)
+
+
+def _load_config_cached(path: str) -> dict:
+    """读取配置，文件未改动时使用上次解析结果；缓存读写失败时直接解析"""
+    st = os.stat(path)
+    key = f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{st.st_ino}"
+    cache_file = os.path.join(CONFIG_CACHE_DIR, hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest() + ".pickle")
+    
+    try:
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        pass
+    
+    data = _parse_config(path)
+    
+    try:
+        _write_cache_file(cache_file, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError as e:
+        print(f"⚠️ 无法写入配置缓存: {e}")
+    
+    return data
+
+
+def _write_cache_file(path: str, data: bytes) -> None:
+    """先写临时文件再替换，多个进程同时写入时不会读到半个缓存文件"""
+    os.makedirs(CONFIG_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CONFIG_CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_config() -> dict:
+    """读取项目根目录的 config.toml，不存在时读取旧的 config.yml"""
+    config_path = os.path.join(base_path, "config.toml")
+    if not os.path.exists(config_path):
+        config_path = os.path.join(base_path, "config.yml")
+    return _load_config_cached(config_path)
+
 
 default_image = os.path.join(base_path, r"assets\default.jpg")
 
 # DeepSeek API configuration
 API_KEY = os.getenv('DEEPSEEK_API_KEY')
 API_URL = "https://api.deepseek.com/chat/completions"
+# 标题提取只需输出一行短文本，可用 DEEPSEEK_TITLE_MODEL 换成更快的模型
+TITLE_MODEL = os.getenv('DEEPSEEK_TITLE_MODEL', 'deepseek-chat')
+HEADERS = {
+    "Authorization": f"Bearer {API_KEY}",
+    "Content-Type": "application/json"
+}
+
+# 文件夹名清理：Windows 文件名非法字符与连续空白
+_ILLEGAL_RE = re.compile(r'[<>:"/\\|?*]')
+_WS_RE = re.compile(r'\s+')
+
+# 本地标题规则：文件名足够规整时直接取出课程主题，不请求API
+# 文件名中的语言后缀（_en, _zh-CN 等），以及不算具体主题、仍需交给AI按课程名称+序号命名的泛称
+_LANG_SUFFIX_RE = re.compile(r'_(?:en|cn|zh(?:-[A-Za-z]+)?)$')
+_TITLE_PATTERNS = [
+    # MIT 6.S184 Flow Matching and Diffusion Models - Lecture 02 - Constructing a Training Target
+    re.compile(r'\bLecture\s*\d+\s*-+\s*(.+?)$', re.IGNORECASE),
+    # L2 Autoregressive Models -- CS294-158 SP24 Deep Unsupervised Learning -- UC Berkeley Spring 2024
+    re.compile(r'^L\d+\s+(.+?)\s+--'),
+]
+_GENERIC_TOPICS = {'introduction', 'intro', 'overview', 'course overview', 'review', 'recap', 'q&a', 'conclusion'}
 
+# 标题缓存：以规范化后原始文件名的 SHA-256 为键，重复运行时既不匹配规则也不请求API；
+# 同一批次中规范化后相同的文件名（如 _en/_cn 两个语言版本）只提取一次，其余线程等待正在进行的那次
+TITLE_CACHE_PATH = os.path.join(CONFIG_CACHE_DIR, "titles.json")
+_title_cache = None
+_title_cache_dirty = False
+_title_inflight = {}
+_title_cache_lock = threading.Lock()
 
-def extract_title_with_ai(original_filename: str) -> str:
+# 并行处理文件的线程数；所有线程共用一个 Session，连接池与线程数一致，HTTPS 连接在请求之间复用
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+
+# frontmatter 模板只在导入时构造一次；日期在每次运行开始时填入，之后每个文件只需填入标题
+FRONTMATTER_TEMPLATE = """---
+title: '{title}'
+publishDate: {date}
+description: 'TODO'
+tags:
+  - TODO
+language: 'English'
+heroImage: {{ src: './default.jpg', color: '#D58388' }}
+---
+
+"""
+
+
+def _title_cache_key(original_filename: str) -> str:
+    """去掉语言后缀、下划线和大小写差异后取 SHA-256"""
+    normalized = ' '.join(_LANG_SUFFIX_RE.sub('', original_filename).replace('_', ' ').split()).lower()
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def _get_title_cache() -> dict:
+    """返回标题缓存，首次调用时从磁盘加载；调用方需持有 _title_cache_lock"""
+    global _title_cache
+    if _title_cache is None:
+        try:
+            with open(TITLE_CACHE_PATH, 'r', encoding='utf-8') as f:
+                _title_cache = json.load(f)
+        except (OSError, ValueError):
+            _title_cache = {}
+    return _title_cache
+
+
+def _cache_title(original_filename: str, title: str) -> None:
+    global _title_cache_dirty
+    if not title:
+        return
+    with _title_cache_lock:
+        _get_title_cache()[_title_cache_key(original_filename)] = title
+        _title_cache_dirty = True
+
+
+def save_title_cache() -> None:
+    """把本次新增的标题写回磁盘"""
+    with _title_cache_lock:
+        if not _title_cache_dirty:
+            return
+        try:
+            _write_cache_file(TITLE_CACHE_PATH, json.dumps(_title_cache, ensure_ascii=False).encode('utf-8'))
+        except OSError as e:
+            print(f"⚠️ 无法写入标题缓存: {e}")
+
+
+def extract_title_by_pattern(original_filename: str) -> Optional[str]:
+    """用本地规则提取课程主题，没有把握时返回 None"""
+    name = ' '.join(_LANG_SUFFIX_RE.sub('', original_filename).replace('_', ' ').split())
+    for pattern in _TITLE_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            topic = match.group(1).strip(' -')
+            # 主题中仍带有分隔符（可能混入了学校、学期等信息）或只是泛称时交给AI
+            if topic and ' - ' not in topic and topic.lower() not in _GENERIC_TOPICS:
+                return topic
+    return None
+
+
+def extract_title_with_ai(original_filename: str, session: requests.Session = SESSION) -> str:
     """
     使用AI从原始文件名中提取简洁的标题
     
+    先查标题缓存，再尝试本地规则，都不命中时才请求API；规则与AI提取的结果写入缓存
+    
     Args:
         original_filename: 原始文件名（不含扩展名）
+        session: 发送请求使用的 Session，默认使用模块共享的连接池
         
     Returns:
         提取后的简洁标题
     """
+    key = _title_cache_key(original_filename)
+    with _title_cache_lock:
+        # 旧版本可能缓存过空标题，视为未命中
+        title = _get_title_cache().get(key) or None
+        pending = _title_inflight.get(key) if title is None else None
+        if title is None and pending is None:
+            future = _title_inflight[key] = Future()
+    
+    if title is not None:
+        print(f"🏷️ 缓存标题: {original_filename} -> {title}")
+        return title
+    
+    if pending is not None:
+        # 同一标题正由其他线程提取，直接等待其结果
+        title = pending.result()
+        print(f"🏷️ 复用标题: {original_filename} -> {title}")
+        return title
+    
+    try:
+        title = _extract_title_uncached(original_filename, session)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(title)
+    finally:
+        with _title_cache_lock:
+            del _title_inflight[key]
+    return title
+
+
+def _extract_title_uncached(original_filename: str, session: requests.Session) -> str:
+    """依次尝试本地规则、AI提取和备用方案"""
+    title = extract_title_by_pattern(original_filename)
+    if title:
+        print(f"🏷️ 规则提取标题: {original_filename} -> {title}")
+        _cache_title(original_filename, title)
+        return title
+    
     if not API_KEY:
         print("⚠️ 未设置 DEEPSEEK_API_KEY，使用备用方案")
         return fallback_title(original_filename)
@@ -54,36 +264,24 @@ def extract_title_with_ai(original_filename: str) -> str:
 - 频道名称、视频编号等无关信息
 
 示例：
-输入：L2 Autoregressive Models -- CS294-158 SP24 Deep Unsupervised Learning -- UC Berkeley Spring 2024_en
-输出：Autoregressive Models
-
-输入：L1 Introduction -- CS294-158 SP24 Deep Unsupervised Learning -- UC Berkeley Spring 2024_en
-输出：Deep Unsupervised Learning Lecture 1
-
 输入：MIT 6.S184 Flow Matching and Diffusion Models - Lecture 01 - Generative AI with SDEs
 输出：Generative AI with SDEs
 
-输入：MIT 6.S184 Flow Matching and Diffusion Models - Lecture 02 - Constructing a Training Target
-输出：Constructing a Training Target
-
-输入：MIT_6.S184__Flow_Matching_and_Diffusion_Models_-_Lecture_02_-_Constructing_a_Training_Target
-输出：Constructing a Training Target
+输入：L1 Introduction -- CS294-158 SP24 Deep Unsupervised Learning -- UC Berkeley Spring 2024_en
+输出：Deep Unsupervised Learning Lecture 1
 
 输入：How to Build a Neural Network from Scratch - Full Tutorial 2024
 输出：Build a Neural Network from Scratch
 
-输入：Why Transformers are Taking Over AI - Explained Simply
-输出：Why Transformers are Taking Over AI
-
 只输出最终的标题，不要任何解释："""
 
     try:
         payload = {
-            "model": "deepseek-chat",
+            "model": TITLE_MODEL,
             "messages": [
                 {
                     "role": "system",
-                    "content": "你是一个专业的标题提取助手，擅长从冗长的视频标题中提取简洁的核心主题。"
+                    "content": "提取视频标题"
                 },
                 {
                     "role": "user",
@@ -91,22 +289,23 @@ def extract_title_with_ai(original_filename: str) -> str:
                 }
             ],
             "temperature": 0.1,
-            "max_tokens": 100
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {API_KEY}",
-            "Content-Type": "application/json"
+            "max_tokens": 32,
+            "stream": False
         }
         
-        response = requests.post(API_URL, json=payload, headers=headers, timeout=30)
+        response = session.post(API_URL, data=orjson.dumps(payload), headers=HEADERS, timeout=30)
         
         if response.status_code == 200:
             result = response.json()
             if 'choices' in result and result['choices']:
-                title = result['choices'][0]['message']['content'].strip()
-                print(f"🏷️ AI提取标题: {original_filename} -> {title}")
-                return title
+                choice = result['choices'][0]
+                title = (choice['message'].get('content') or '').strip()
+                # 输出被 max_tokens 截断（推理模型可能在输出标题前就用完额度）或为空时不采用，也不缓存
+                if title and choice.get('finish_reason') != 'length':
+                    print(f"🏷️ AI提取标题: {original_filename} -> {title}")
+                    _cache_title(original_filename, title)
+                    return title
+                print(f"⚠️ AI返回的标题为空或被截断 (finish_reason: {choice.get('finish_reason')})")
                 
     except Exception as e:
         print(f"⚠️ AI提取标题失败: {e}")
@@ -123,47 +322,19 @@ def fallback_title(original_filename: str) -> str:
 
 def sanitize_filename(title: str) -> str:
     """将标题转换为有效的文件夹名"""
-    # 移除非法字符
-    name = re.sub(r'[<>:"/\\|?*]', '', title)
-    # 空格替换为下划线
-    name = re.sub(r'\s+', '_', name)
-    name = name.strip('_')
-    return name
+    # 移除非法字符，空格替换为下划线
+    return _WS_RE.sub('_', _ILLEGAL_RE.sub('', title)).strip('_')
 
 
-# Get all markdown files in processed folder
-files = [f for f in os.listdir(processed_path) if f.endswith('.md')]
-
-for filename in files:
-    file_path = os.path.join(processed_path, filename)
-    
+def process_file(filename: str, file_path: str, output_path: str, frontmatter_template: str) -> None:
+    """为单个 Markdown 文件提取标题、添加 frontmatter 并复制到博客目录"""
     # 使用 AI 从原始文件名提取标题
     original_name = filename.replace('.md', '')
     title = extract_title_with_ai(original_name)
     folder_name = sanitize_filename(title)
     
-    # Read original content
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # Get current date
-    current_date = datetime.now().strftime('%Y-%m-%d')
-    
     # Create frontmatter
-    frontmatter = f"""---
-title: '{title[:59]}'
-publishDate: {current_date}
-description: 'TODO'
-tags:
-  - TODO
-language: 'English'
-heroImage: {{ src: './default.jpg', color: '#D58388' }}
----
-
-"""
-    
-    # Combine frontmatter with content
-    new_content = frontmatter + content
+    frontmatter = frontmatter_template.format(title=title[:59])
     
     # Create new folder
     new_folder = os.path.join(output_path, folder_name)
@@ -172,14 +343,73 @@ heroImage: {{ src: './default.jpg', color: '#D58388' }}
     # Write updated file to new folder (use sanitized filename)
     new_filename = f"{folder_name}.md"
     new_file_path = os.path.join(new_folder, new_filename)
-    with open(new_file_path, 'w', encoding='utf-8') as f:
-        f.write(new_content)
+    # 先写 frontmatter，再把正文按字节原样转写：内存映射源文件，由系统按需换页，不经过 UTF-8 解码和重新编码。
+    # 不同语言版本（如 X_en.md 与 X_cn.md）可能得到同一个目标文件，并行写入时先写各自的临时文件再整体替换，
+    # 目标文件总是某一个版本的完整内容
+    tmp_path = f"{new_file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as dst:
+            dst.write(frontmatter.encode('utf-8'))
+            with open(file_path, 'rb') as src:
+                # 空文件无法映射
+                if os.fstat(src.fileno()).st_size:
+                    with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as body:
+                        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                            body.madvise(mmap.MADV_SEQUENTIAL)
+                        dst.write(body)
+        os.replace(tmp_path, new_file_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
     
-    # Copy default.jpg to new folder
+    # Link default.jpg into new folder; 跨磁盘、文件系统不支持硬链接或目标已存在时退回复制
     new_image_path = os.path.join(new_folder, "default.jpg")
-    shutil.copy2(default_image, new_image_path)
+    try:
+        os.link(default_image, new_image_path)
+    except FileExistsError:
+        # 重复运行时已经是同一个文件（硬链接），无需处理
+        if not os.path.samefile(default_image, new_image_path):
+            shutil.copy2(default_image, new_image_path)
+    except OSError:
+        shutil.copy2(default_image, new_image_path)
     
     print(f"✅ Processed {filename} -> {folder_name}/")
 
-print("\n🎉 All files processed successfully!")
-print(f"📊 Total files processed: {len(files)}")
+
+def _iter_markdown_files(folder: str) -> Iterator[os.DirEntry]:
+    """逐个产出文件夹中的 Markdown 文件，名称与类型直接取自目录项"""
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.name.endswith('.md') and entry.is_file():
+                yield entry
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口，也可由 main.py 在同一进程中直接调用"""
+    parser = argparse.ArgumentParser(description='为 output 文件夹中的 Markdown 文件添加 frontmatter 并复制到博客目录')
+    parser.parse_args(argv)
+    
+    # Load config
+    output_path = load_config()['output_path']
+    
+    # Get current date (same for every file)
+    current_date = datetime.now().strftime('%Y-%m-%d')
+    # 正文按字节原样写出，frontmatter 的换行与文本模式写出时保持一致
+    frontmatter_template = FRONTMATTER_TEMPLATE.replace('{date}', current_date).replace('\n', os.linesep)
+    
+    # 每个文件的耗时主要在等待标题提取的API响应和磁盘读写，用线程池并行处理
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        total = sum(1 for _ in executor.map(
+            lambda entry: process_file(entry.name, entry.path, output_path, frontmatter_template),
+            _iter_markdown_files(processed_path)
+        ))
+    save_title_cache()
+    
+    print("\n🎉 All files processed successfully!")
+    print(f"📊 Total files processed: {total}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,24 +7,30 @@
 
 import sys
 import os
+import importlib
+import contextlib
 import subprocess
 from pathlib import Path
 import argparse
 import shutil
 
+# 各步骤脚本所在目录，只计算一次
+_TOOLS_DIR = Path(__file__).resolve().parent
 
-def run_script(script_name: str, args: list = None) -> bool:
+
+def run_script(script_name: str, args: list = None, quiet: bool = False) -> bool:
     """
     运行指定的脚本
     
     Args:
         script_name: 脚本名称
         args: 传递给脚本的参数列表
+        quiet: 丢弃脚本的标准输出（标准错误仍直接输出，失败原因可见）
         
     Returns:
         成功返回True，失败返回False
     """
-    script_path = Path(__file__).parent / script_name
+    script_path = _TOOLS_DIR / script_name
     
     if not script_path.exists():
         print(f"❌ 错误: 找不到脚本 {script_name}")
@@ -40,23 +46,82 @@ def run_script(script_name: str, args: list = None) -> bool:
     print(f"{'='*60}")
     
     try:
-        # 执行脚本
-        result = subprocess.run(
-            cmd,
-            check=True,
-            text=True,
-            encoding='utf-8'
-        )
+        # 执行脚本：支持 posix_spawn 的平台直接启动子进程，不复制父进程的页表；其余平台（Windows）使用 subprocess
+        # 子进程的输出不经过管道，直接写到继承的终端或 /dev/null；只检查退出码
+        if hasattr(os, 'posix_spawn'):
+            sys.stdout.flush()
+            file_actions = [(os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0)] if quiet else []
+            pid = os.posix_spawn(sys.executable, cmd, os.environ, file_actions=file_actions)
+            _, status = os.waitpid(pid, 0)
+            returncode = os.waitstatus_to_exitcode(status)
+        else:
+            returncode = subprocess.run(
+                cmd,
+                stdout=subprocess.DEVNULL if quiet else None,
+                text=True,
+                encoding='utf-8'
+            ).returncode
+        
+        if returncode != 0:
+            print(f"❌ {script_name} 执行失败，退出码: {returncode}")
+            return False
         
         print(f"✅ {script_name} 执行成功")
         return True
         
-    except subprocess.CalledProcessError as e:
-        print(f"❌ {script_name} 执行失败，退出码: {e.returncode}")
+    except Exception as e:
+        print(f"❌ 执行 {script_name} 时出错: {e}")
         return False
+
+
+def run_module(module_name: str, args: list = None, quiet: bool = False) -> bool:
+    """
+    在当前进程中导入脚本模块并调用其 main(argv)，省去启动新解释器的开销；
+    模块无法导入时退回 run_script 在子进程中执行
+    
+    Args:
+        module_name: 模块名称（不含 .py）
+        args: 传递给脚本的参数列表
+        quiet: 丢弃脚本 print 的输出（日志与标准错误不受影响）
+        
+    Returns:
+        成功返回True，失败返回False
+    """
+    script_name = f"{module_name}.py"
+    
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        print(f"⚠️ 无法导入 {script_name} ({e})，改为在子进程中执行")
+        return run_script(script_name, args, quiet)
+    except SystemExit as e:
+        print(f"❌ 导入 {script_name} 失败，退出码: {e.code}")
+        return False
+    
+    print(f"\n{'='*60}")
+    print(f"🚀 执行: {script_name}")
+    print(f"{'='*60}")
+    
+    try:
+        with contextlib.ExitStack() as stack:
+            if quiet:
+                stack.enter_context(contextlib.redirect_stdout(
+                    stack.enter_context(open(os.devnull, 'w', encoding='utf-8'))
+                ))
+            # 必须显式传入参数列表，否则各脚本会解析 main.py 自己的命令行参数
+            exit_code = module.main(list(args or []))
+    except SystemExit as e:
+        exit_code = e.code
     except Exception as e:
         print(f"❌ 执行 {script_name} 时出错: {e}")
         return False
+    
+    if exit_code:
+        print(f"❌ {script_name} 执行失败，退出码: {exit_code}")
+        return False
+    
+    print(f"✅ {script_name} 执行成功")
+    return True
 
 
 def main():
@@ -83,6 +148,12 @@ def main():
         help='要下载的字幕语言 (默认: en)'
     )
     
+    parser.add_argument(
+        '--quiet', '-q',
+        action='store_true',
+        help='不显示各步骤脚本的标准输出，只显示进度与错误'
+    )
+    
     args = parser.parse_args()
     
     print("="*60)
@@ -95,7 +166,7 @@ def main():
     print("\n📥 步骤 1/3: 下载字幕...")
     downloader_args = [args.youtube_link, '--languages'] + args.languages
     if args.youtube_link:
-        if not run_script('downloader.py', downloader_args):
+        if not run_module('downloader', downloader_args, args.quiet):
             print("\n❌ 管道执行失败: 字幕下载失败")
             sys.exit(1)
     
@@ -103,13 +174,13 @@ def main():
     print("\n🔄 步骤 2/3: 转换字幕...")
     # converter.py 会自动处理 raw 文件夹中的文件
     # 需要设置 DEEPSEEK_API_KEY 环境变量
-    if not run_script('converter.py'):
+    if not run_module('converter', quiet=args.quiet):
         print("\n❌ 管道执行失败: 字幕转换失败")
         sys.exit(1)
     
     # 步骤3: 格式化输出
     print("\n📝 步骤 3/3: 格式化输出...")
-    if not run_script('formatter.py'):
+    if not run_module('formatter', quiet=args.quiet):
         print("\n❌ 管道执行失败: 格式化失败")
         sys.exit(1)
     
@@ -0,0 +1,85 @@
+"""
+字幕文本处理的纯字符串函数
+
+这些函数不依赖转换器状态、全部带类型注解，可以用 mypyc 编译为C扩展：
+    cd tools && mypyc text_utils.py
+编译产物 text_utils.*.so（Windows 下为 .pyd）与本文件同目录时会被优先导入；
+没有C编译环境时直接使用本文件，行为完全一致。
+"""
+
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+# 句子边界：句末标点后的空白，且下一个词以大写字母、数字或引号开头
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+(?=["\'(\[]?[A-Z0-9])')
+
+# 流式分句时，长时间找不到句子边界（无标点字幕）的缓冲上限，超过后直接交给分块器按单词硬切
+MAX_PENDING_CHARS = 64 * 1024
+
+# AI返回内容中的不完整句子标记
+INCOMPLETE_RE = re.compile(r'\[不完整句子:\s*([^\]]+)\]')
+
+# 方括号标注，如 [Music]
+BRACKET_RE = re.compile(r'\[[^\]]*\]')
+
+# 琐碎块判定：去掉 [Music] 等方括号标注后，剩余字母数字少于该值或不同单词数不超过该值的块不请求API
+TRIVIAL_MIN_ALNUM = 20
+TRIVIAL_MAX_UNIQUE_WORDS = 3
+WORD_RE = re.compile(r'\w+')
+
+BLANKLINES_RE = re.compile(r'\n{3,}')
+# 排版整理一次扫描完成：标题前的换行统一为一个空行，其余三个以上的连续换行合并为一个空行
+LAYOUT_RE = re.compile(r'\n+(?=#{1,6}\s)|\n{3,}')
+
+
+def split_sentences(text: str) -> List[str]:
+    """按句子边界切分整段文本"""
+    return SENTENCE_SPLIT_RE.split(text)
+
+
+def iter_sentences(lines: Iterable[str]) -> Iterator[str]:
+    """从逐行输入中切出完整句子，跨行的句子会等到句末出现后再产出"""
+    pending = ""
+    for line in lines:
+        # 尚未确认的句子边界只可能出现在旧缓冲末尾的空白处，从那里继续扫描
+        scan_from = len(pending.rstrip())
+        pending += line
+
+        start = 0
+        for match in SENTENCE_SPLIT_RE.finditer(pending, scan_from):
+            yield pending[start:match.start()]
+            start = match.end()
+        pending = pending[start:]
+
+        if len(pending) > MAX_PENDING_CHARS:
+            yield pending
+            pending = ""
+
+    if pending:
+        yield pending
+
+
+def is_trivial(chunk: str) -> bool:
+    """判断块是否只有静音/音乐标注或重复的填充词"""
+    text = BRACKET_RE.sub(' ', chunk.strip())
+    if sum(1 for ch in text if ch.isalnum()) < TRIVIAL_MIN_ALNUM:
+        return True
+    return len({w.lower() for w in WORD_RE.findall(text)}) <= TRIVIAL_MAX_UNIQUE_WORDS
+
+
+def split_incomplete(content: str) -> Tuple[str, str]:
+    """
+    拆出AI标记的不完整句子
+
+    Returns:
+        (移除标记后的内容, 不完整句子)；没有标记时原样返回内容和空字符串
+    """
+    match = INCOMPLETE_RE.search(content)
+    if match is None:
+        return content, ""
+    return INCOMPLETE_RE.sub('', content).strip(), match.group(1).strip()
+
+
+def normalize_layout(content: str) -> str:
+    """标题前补空行、合并多余空行并去掉首尾空白"""
+    return LAYOUT_RE.sub('\n\n', content).strip()